@@ -0,0 +1,71 @@
+import csv
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import optimization as opt
+import first_principles_model as fp
+
+RESULT_COLUMNS = ['file', 'Kp', 'tauP', 'thetaP', 'FOPDT SSE', 'FOPDT time',
+                  'UA', 'alpha', 'FP SSE', 'FP time', 'error']
+
+
+def fit_run(data_file):
+    '''Fit FOPDT and first-principles parameters to one run data file
+
+    Returns a row of RESULT_COLUMNS. A model that cannot be fit to the file
+    (e.g. a step test without the outside temperature) is left blank and the
+    reason is recorded in the error column.
+    '''
+    row = dict.fromkeys(RESULT_COLUMNS, '')
+    row['file'] = data_file
+    errors = []
+
+    start = time.perf_counter()
+    try:
+        sol = opt.optimize_parameters(data_file, show_plot=False)
+        row.update(Kp=sol['Kp'], tauP=sol['tauP'], thetaP=sol['thetaP'])
+        row['FOPDT SSE'] = sol['SSE']
+    except Exception as error:
+        errors.append('FOPDT: {!r}'.format(error))
+    row['FOPDT time'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    try:
+        sol = fp.optimize_parameters(data_file=data_file)
+        row.update(UA=sol['UA'], alpha=sol['alpha'])
+        row['FP SSE'] = sol['SSE']
+    except Exception as error:
+        errors.append('FP: {!r}'.format(error))
+    row['FP time'] = time.perf_counter() - start
+
+    row['error'] = '; '.join(errors)
+    return row
+
+
+def fit_directory(directory='.', pattern='*.csv', results_file='fit_results.csv', processes=None):
+    '''Fit every run data file in a directory on a pool of processes
+
+    Writes one row per file to results_file (which is skipped if it
+    matches pattern) and returns the rows.
+    '''
+    results_path = os.path.abspath(results_file)
+    files = sorted(f for f in glob.glob(os.path.join(directory, pattern))
+                   if os.path.abspath(f) != results_path)
+
+    with ProcessPoolExecutor(processes) as pool:
+        rows = list(pool.map(fit_run, files))
+
+    with open(results_file, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+    return rows
+
+
+if __name__ == '__main__':
+    directory = sys.argv[1] if len(sys.argv) > 1 else '.'
+    start = time.perf_counter()
+    rows = fit_directory(directory)
+    print('Fit {} files in {:.2f} s, results saved to fit_results.csv'.format(len(rows), time.perf_counter() - start))
@@ -0,0 +1,151 @@
+import numpy as np
+import first_principles_model as fp
+from setpoints import MODEL_SCHEDULE, load_schedule
+
+
+class FirstPrinciplesPlant(object):
+    '''First-principles enclosure model for N closed loops advanced in lockstep
+
+    Each step uses the exact solution of fp.first_principles for a heater
+    output held over the step. Parameters may be scalars or length-N arrays.
+    '''
+    def __init__(self, FP_parameters, T_ambient=25, T0=25):
+        self.UA, self.alpha = FP_parameters
+        self.T_ambient = T_ambient
+        self.T0 = T0
+
+    def reset(self, n):
+        self.T = np.full(n, self.T0, dtype=float)
+        return self.T
+
+    def step(self, u, dt):
+        a = np.exp(-dt/(self.UA*fp.m*fp.Cp))
+        T_ss = self.T_ambient + self.alpha*self.UA*u
+        self.T = T_ss + (self.T - T_ss)*a
+        return self.T
+
+
+class FopdtPlant(object):
+    '''FOPDT model for N closed loops advanced in lockstep
+
+    Uses the exact zero-order-hold step of the model, with the dead time
+    rounded to whole time steps and applied through a ring buffer of past
+    heater outputs.
+    '''
+    def __init__(self, FOPDT_parameters, T0=25, u0=0):
+        self.Kp, self.tauP, self.thetaP = FOPDT_parameters
+        self.T0 = T0
+        self.u0 = u0
+
+    def reset(self, n):
+        self.y = np.zeros(n)
+        self._history = None
+        self._n = n
+        return self.T0 + self.y
+
+    def step(self, u, dt):
+        delay = int(round(self.thetaP/dt))
+        if self._history is None:
+            self._history = np.full((delay + 1, self._n), float(self.u0))
+            self._k = 0
+        self._history[self._k % (delay + 1)] = u
+        self._k += 1
+        u_delayed = self._history[self._k % (delay + 1)]
+        a = np.exp(-dt/self.tauP)
+        self.y = a*self.y + self.Kp*(1 - a)*(u_delayed - self.u0)
+        return self.T0 + self.y
+
+
+def closed_loop_metrics(t, T, u, sp):
+    '''performance metrics of closed-loop trajectories (one column per loop)'''
+    dt = np.diff(t, prepend=0)[:, None]
+    err = sp[:, None] - T
+    return {
+        'IAE': np.sum(np.abs(err)*dt, axis=0),
+        'ITAE': np.sum(t[:, None]*np.abs(err)*dt, axis=0),
+        'ISE': np.sum(err**2*dt, axis=0),
+        'overshoot': np.max(np.maximum(-err, 0), axis=0),
+        'effort': np.sum(np.abs(np.diff(u, axis=0)), axis=0),
+        'mean_u': np.mean(u, axis=0),
+    }
+
+
+def simulate_pid(PID_parameters, plant, run_time, setpoint=MODEL_SCHEDULE, dt=1.0,
+                 max_err_sum=5, trajectories=True, law='model'):
+    '''Simulate many PID-controlled closed loops at once
+
+    PID_parameters:  (N, 3) array of (K_c, tau_I, tau_D) rows, one per loop
+
+    plant:           plant model with reset(n) and step(u, dt), e.g.
+                     FirstPrinciplesPlant
+
+    run_time:        total run time in minutes
+
+    setpoint:        SetpointSchedule (or a file to load one from)
+
+    dt:              simulation time step in seconds
+
+    max_err_sum:     anti-windup clamp on the integrated error (model law only)
+
+    law:             'model' for the controller of fp.run_model: the
+                     integral starts after 60 s and is clamped to
+                     max_err_sum. 'hardware' for the controller of
+                     runs.PidLoop.tick, with one tick per dt: the integral
+                     and output limits start after tick 10, integration is
+                     undone while the output is saturated instead of being
+                     clamped, and the derivative is the change per tick from
+                     a previous temperature of 0
+
+    In both the heater output is clamped to 0-100% and the derivative acts
+    on the measurement. Returns a dict with the time and set point arrays, the
+    (steps, N) temperature and heater trajectories (unless trajectories is
+    False) and the closed_loop_metrics of every loop.
+    '''
+    gains = np.atleast_2d(np.asarray(PID_parameters, dtype=float))
+    Kc, tau_I, tau_D = gains.T
+    setpoint = load_schedule(setpoint)
+    n_loops = len(gains)
+    n_steps = int(round(run_time*60/dt))
+
+    t = np.arange(1, n_steps + 1)*dt
+    sp = np.array([setpoint(i*dt) for i in range(n_steps)])
+    T_hist = np.empty((n_steps, n_loops))
+    u_hist = np.empty((n_steps, n_loops))
+
+    if law not in ('model', 'hardware'):
+        raise ValueError('unknown PID law {!r}'.format(law))
+    T = plant.reset(n_loops)
+    prev_temp = T.copy() if law == 'model' else np.zeros(n_loops)
+    err_sum = np.zeros(n_loops)
+    for i in range(n_steps):
+        err = sp[i] - T
+        if law == 'model':
+            P = Kc*err
+            I = Kc/tau_I*err_sum
+            D = -Kc*tau_D*(T - prev_temp)/dt
+
+            if i*dt > 60:
+                err_sum += err*dt
+            np.minimum(err_sum, max_err_sum, out=err_sum)
+        else:
+            if i > 10:
+                err_sum += err*dt
+            P = Kc*err
+            I = Kc/tau_I*err_sum
+            D = -Kc*tau_D*(T - prev_temp)
+            if i > 10:
+                # Undo the integration while the output is saturated
+                u = (P + I + D)*100
+                err_sum -= np.where((u > 100) | (u < 0), err*dt, 0)
+
+        prev_temp = T
+        u = np.clip((P + I + D)*100, 0, 100)
+        T = plant.step(u, dt)
+        T_hist[i] = prev_temp
+        u_hist[i] = u
+
+    result = {'t': t, 'SP': sp, 'metrics': closed_loop_metrics(t, T_hist, u_hist, sp)}
+    if trajectories:
+        result['box temp'] = T_hist
+        result['control output'] = u_hist
+    return result
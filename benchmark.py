@@ -0,0 +1,179 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import optimization as opt
+import first_principles_model as fp
+import runs
+from hardware import SimulatedBackend
+
+DATA_FILES = ['first_run_data.csv', 'final_real_run.csv', 'no_deriv.csv', 'step_test.csv']
+SYNTHETIC_MINUTES = [30, 120, 600]
+PID_PARAMETERS = (2, 75, 0)
+FP_PARAMETERS = (94.999, 0.0024)
+
+
+class _Counter(object):
+    '''wrap a module function and count how often it is called'''
+    def __init__(self, module, name):
+        self.module, self.name = module, name
+        self.calls = 0
+
+    def __enter__(self):
+        self.original = getattr(self.module, self.name)
+
+        def counted(*args, **kwargs):
+            self.calls += 1
+            return self.original(*args, **kwargs)
+        setattr(self.module, self.name, counted)
+        return self
+
+    def __exit__(self, *exc):
+        setattr(self.module, self.name, self.original)
+        return False
+
+
+def measure(func, repeat=3):
+    '''best wall time of func over repeat calls, and the peak memory of one call
+
+    func returns a dict of work counts that are turned into rates.
+    '''
+    times = []
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            work = func()
+            times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    with contextlib.redirect_stdout(io.StringIO()):
+        func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    seconds = min(times)
+    return {
+        'seconds': seconds,
+        'peak_mb': peak/1e6,
+        'throughput': {name + '/s': count/seconds for name, count in work.items()},
+    }
+
+
+def bench_fopdt_fit(data_file):
+    def run():
+        with _Counter(opt, 'fopdt_residuals') as evals:
+            opt.optimize_parameters(data_file, show_plot=False)
+        return {'samples': len(opt.read_data_file(data_file)[0]), 'objective evals': evals.calls}
+    return run
+
+
+def bench_fp_fit(data_file):
+    def run():
+        with _Counter(fp, 'model_residuals') as evals:
+            fp.optimize_parameters(data_file=data_file)
+        return {'samples': len(fp.load_data(data_file)), 'objective evals': evals.calls}
+    return run
+
+
+def bench_run_model(minutes):
+    def run():
+        fp.run_model(minutes, PID_PARAMETERS, FP_PARAMETERS, data_file=None, headless=True)
+        return {'simulated s': minutes*60}
+    return run
+
+
+def bench_run_controller(minutes, data_file):
+    def run():
+        backend = SimulatedBackend(FP_PARAMETERS, speedup=None, seed=0)
+        recorder = runs.run_controller(minutes, PID_PARAMETERS, show_plot=False, data_file=data_file,
+                                       backend=backend)
+        return {'iterations': recorder.count, 'simulated s': minutes*60}
+    return run
+
+
+def synthetic_run(minutes, directory):
+    '''write a simulated run of the given length to use as fitting data'''
+    data_file = os.path.join(directory, 'synthetic_{}min.csv'.format(minutes))
+    fp.run_model(minutes, PID_PARAMETERS, FP_PARAMETERS, data_file=data_file, headless=True)
+    return data_file
+
+
+def run_benchmarks(repeat=3, synthetic_minutes=SYNTHETIC_MINUTES):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        data_files = [f for f in DATA_FILES if os.path.exists(f)]
+        data_files += [synthetic_run(minutes, tmp) for minutes in synthetic_minutes]
+        for data_file in data_files:
+            name = os.path.basename(data_file)
+            results['fopdt_fit[{}]'.format(name)] = measure(bench_fopdt_fit(data_file), repeat)
+            results['fp_fit[{}]'.format(name)] = measure(bench_fp_fit(data_file), repeat)
+
+        for minutes in synthetic_minutes:
+            results['run_model[{}min]'.format(minutes)] = measure(bench_run_model(minutes), repeat)
+
+        log_file = os.path.join(tmp, 'controller.csv')
+        for minutes in synthetic_minutes:
+            results['run_controller[{}min]'.format(minutes)] = measure(bench_run_controller(minutes, log_file), repeat)
+
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'results': results,
+    }
+
+
+def compare(current, baseline, tolerance=1.25, noise=0.002):
+    '''print each benchmark against a baseline, returning the names that got slower than tolerance
+
+    Slowdowns of less than noise seconds are not counted as regressions.
+    '''
+    regressions = []
+    for name, result in current['results'].items():
+        base = baseline['results'].get(name)
+        if base is None:
+            print('{:40s} {:10.4f} s  (new)'.format(name, result['seconds']))
+            continue
+        ratio = result['seconds']/base['seconds']
+        flag = ''
+        if ratio > tolerance and result['seconds'] - base['seconds'] > noise:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print('{:40s} {:10.4f} s  {:6.2f}x baseline, peak {:.1f} MB{}'.format(
+            name, result['seconds'], ratio, result['peak_mb'], flag))
+    return regressions
+
+
+def report(current):
+    for name, result in current['results'].items():
+        rates = ', '.join('{:.4g} {}'.format(v, k) for k, v in result['throughput'].items())
+        print('{:40s} {:10.4f} s  peak {:6.1f} MB  {}'.format(name, result['seconds'], result['peak_mb'], rates))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time the fitting, simulation and control loop hot paths')
+    parser.add_argument('--save', metavar='FILE', help='save the results as a JSON baseline')
+    parser.add_argument('--compare', metavar='FILE', help='compare against a saved JSON baseline')
+    parser.add_argument('--tolerance', type=float, default=1.25, help='slowdown ratio reported as a regression')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per benchmark (best is kept)')
+    parser.add_argument('--quick', action='store_true', help='only use the shortest synthetic run')
+    args = parser.parse_args()
+
+    current = run_benchmarks(args.repeat, SYNTHETIC_MINUTES[:1] if args.quick else SYNTHETIC_MINUTES)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(current, json.load(f), args.tolerance)
+    else:
+        regressions = []
+        report(current)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(current, f, indent=2)
+    sys.exit(1 if regressions else 0)
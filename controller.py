@@ -1,8 +1,20 @@
+import numpy as np
 import runs
 import optimization as opt
+import tuning
+from gainschedule import imc_gains
+from mpc import FopdtMpc
+from online_id import OnlineFopdt
 
 class Controller(object):
-    def __init__(self):
+    def __init__(self, backend=None, enclosure_id='enclosure', cache=None):
+        # Hardware to run on (None for the Pi's TCLab and DHT sensors)
+        self.backend = backend
+
+        # tuningcache.TuningCache of fitted parameters, stored under enclosure_id
+        self.enclosure_id = enclosure_id
+        self.cache = cache
+
         # Initial PID and FOPDT parameters
         self.K_c = 1.44
         self.Tau_I = 221.925
@@ -11,28 +23,147 @@ class Controller(object):
         self.Tau_p = 159.4251614964272
         self.Theta_P = 124.9997
 
+        # Online FOPDT identifier of the last run (see run)
+        self.identifier = None
+
+        # gainschedule.GainSchedule used instead of the fixed gains when set
+        self.gain_schedule = None
+
+        # Start from this enclosure's last tuning if it was cached
+        if cache is not None:
+            model = cache.lookup(enclosure_id, 'FOPDT')
+            if model:
+                self.K_p, self.Tau_p, self.Theta_P = model['parameters']
+            gains = cache.lookup(enclosure_id, 'PID')
+            if gains:
+                self.K_c, self.Tau_I, self.Tau_D = gains['K_c'], gains['Tau_I'], gains['Tau_D']
+
+    def set_model(self, K_p, Tau_p, Theta_P):
+        '''Use a FOPDT model and set the IMC-style PID gains for it'''
+        self.K_p = K_p
+        self.Tau_p = Tau_p
+        self.Theta_P = Theta_P
+        self.K_c, self.Tau_I, self.Tau_D = imc_gains(K_p, Tau_p, Theta_P)
+
+    def auto_tune(self, optimize=False, processes=None, early_stop=True):
+        '''Fit the FOPDT model to a doublet test and tune the PID from it
+
+        With early_stop the model is refit while the test runs and the test
+        ends as soon as the estimates converge (see
+        optimization.StreamingFit), instead of always running for 1200 s
+        and fitting afterwards.
+
+        With optimize the IMC-style gains are only a starting point for
+        tuning.tune_pid, which searches gains against a simulated closed
+        loop on the fitted model using a pool of processes.
+
+        With a cache the fit starts from the enclosure's cached model, and
+        the new model and gains are stored in the cache.
 
-    def auto_tune(self):
+        Returns the gains, the length of the test and the time spent in the
+        optimization stage.
+        '''
         # Run a step test
         print('Running a doublet test on the system...')
-        runs.doublet_test(data_file='tuning_step_test.csv', show_plot=False)
+        cached = self.cache.lookup(self.enclosure_id, 'FOPDT') if self.cache else None
+        fit = None
+        if early_stop:
+            fit = opt.StreamingFit(guess=cached['parameters']) if cached else opt.StreamingFit()
+        test_time = runs.doublet_test(data_file='tuning_step_test.csv', show_plot=False,
+                                      backend=self.backend, fit=fit)
         
         # Fit the FOPDT parameters
-        print('Fitting FOPDT parameters to the data...')
-        sol = opt.optimize_parameters('tuning_step_test.csv')
-        self.K_p = sol['Kp']
-        self.Tau_p = sol['tauP']
-        self.Theta_P = sol['thetaP']
+        if early_stop:
+            sol = fit.estimates() if fit.converged() else fit.fit()
+            if self.cache:
+                self.cache.record_fopdt(self.enclosure_id, 'tuning_step_test.csv', sol)
+        elif self.cache:
+            print('Fitting FOPDT parameters to the data...')
+            sol = self.cache.fit_fopdt(self.enclosure_id, 'tuning_step_test.csv')
+        else:
+            print('Fitting FOPDT parameters to the data...')
+            sol = opt.optimize_parameters('tuning_step_test.csv', show_plot=False)
         
         # Determine the PID tuning parameters
         print('Determining initial PID tuning parameters')
-        tau_c = max(self.Tau_p, 8*self.Theta_P)
+        self.set_model(sol['Kp'], sol['tauP'], sol['thetaP'])
 
-        self.K_c = 1/self.K_p * (self.Tau_p + 0.5*self.Theta_P) / (tau_c + self.Theta_P)
-        self.Tau_I = self.Tau_p + 0.5*self.Theta_P
-        self.Tau_D = self.Tau_p*self.Theta_P / (2*self.Tau_p + self.Theta_P)
-        return
+        tuning_time = 0
+        if optimize:
+            print('Optimizing PID tuning parameters on the simulated system...')
+            best = tuning.tune_pid((self.K_p, self.Tau_p, self.Theta_P),
+                                   (self.K_c, self.Tau_I, self.Tau_D), processes=processes)
+            self.K_c, self.Tau_I, self.Tau_D = best['K_c'], best['Tau_I'], best['Tau_D']
+            tuning_time = best['tuning_time']
+        if self.cache:
+            self.cache.record_pid(self.enclosure_id, self.K_c, self.Tau_I, self.Tau_D)
+        return {'K_c': self.K_c, 'Tau_I': self.Tau_I, 'Tau_D': self.Tau_D, 'test_time': test_time,
+                'tuning_time': tuning_time}
+
+    def _mpc(self, mode):
+        if mode not in ('pid', 'mpc'):
+            raise ValueError("mode must be 'pid' or 'mpc'")
+        return FopdtMpc((self.K_p, self.Tau_p, self.Theta_P)) if mode == 'mpc' else None
+
+    def loop(self, mode='pid', **kwargs):
+        '''runs.PidLoop with the current gains (or model, for mode='mpc') on this controller's hardware'''
+        kwargs.setdefault('gain_schedule', self.gain_schedule)
+        return runs.PidLoop((self.K_c, self.Tau_I, self.Tau_D), backend=self.backend,
+                            mpc=self._mpc(mode), **kwargs)
+
+    def run(self, run_time, identify=False, adapt=False, mode='pid'):
+        '''Run the control loop for run_time minutes
 
-    def run(self, run_time):
-        runs.run_controller(run_time, (self.K_c, self.Tau_I, self.Tau_D))
+        mode is 'pid' for the PID with the current gains, or 'mpc' for
+        model predictive control (mpc.FopdtMpc) on the current FOPDT model.
+
+        With identify an online_id.OnlineFopdt, kept as self.identifier,
+        estimates the FOPDT model from the running loop. Its estimates can
+        be read from another thread while the loop runs. With adapt the
+        model and gains are set from the final estimates after the run if
+        they pass the checks of adapt.
+        '''
+        identifier = None
+        if identify or adapt:
+            identifier = OnlineFopdt(initial=(self.K_p, self.Tau_p, self.Theta_P))
+        self.identifier = identifier
+        recorder = runs.run_controller(run_time, (self.K_c, self.Tau_I, self.Tau_D), backend=self.backend,
+                                       identifier=identifier, gain_schedule=self.gain_schedule,
+                                       mpc=self._mpc(mode))
+        if adapt:
+            self.adapt(identifier, recorder)
         return
+
+    def adapt(self, identifier, recorder):
+        '''Set the model and gains from an online identifier's estimates
+
+        The estimates are only taken if the identifier is confident in them
+        and they fit the recorded run (a runs.RunRecorder) better than the
+        current model does. Returns whether the model was changed.
+        '''
+        estimates = identifier.estimates()
+        if not identifier.confident():
+            print('Model kept: the online estimates are not confident yet ({})'.format(estimates))
+            return False
+        new = (estimates['Kp'], estimates['tauP'], estimates['thetaP'])
+        old = (self.K_p, self.Tau_p, self.Theta_P)
+        t = recorder.column('time')
+        # The heaters clamp the output to 0-100
+        u = np.clip(recorder.column('control output'), 0, 100)
+        T = recorder.column('box temp')
+
+        # The record does not start from a steady state, so the fits are
+        # compared once both models have settled, up to a constant offset
+        keep = t >= t[0] + 3*max(new[1], old[1]) + max(new[2], old[2])
+        if keep.sum() < 2:
+            print('Model kept: the run is too short to compare the models')
+            return False
+        errors = []
+        for model in (new, old):
+            residuals = opt.fopdt_residuals(model, t, u, T)[keep]
+            errors.append(np.sum((residuals - residuals.mean())**2))
+        if not errors[0] < errors[1]:
+            print('Model kept: the online estimates fit the run worse ({:.1f} vs {:.1f})'.format(*errors))
+            return False
+        self.set_model(*new)
+        return True
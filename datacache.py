@@ -0,0 +1,75 @@
+import glob
+import hashlib
+import os
+import numpy as np
+from numpy.lib import recfunctions
+
+CACHE_DIR = '.run_cache'
+
+# Bumped when the cached layout changes, so older caches are rebuilt
+CACHE_FORMAT = 2
+
+
+def _read_header(data_file):
+    '''column names from the commented header line of a run file'''
+    with open(data_file) as f:
+        first = f.readline()
+    if not first.startswith('#'):
+        return []
+    return [name.strip() for name in first.lstrip('#').split(',')]
+
+
+def _convert(data_file, cache_file):
+    '''Parse a run CSV and save it as a structured .npy array'''
+    data = np.loadtxt(data_file, delimiter=',', ndmin=2)
+    names = _read_header(data_file)
+    names += ['column {}'.format(i) for i in range(len(names), data.shape[1])]
+    # Logs with fewer values than header names (e.g. doublet tests, which
+    # have no PID terms) keep every column, with the missing ones NaN
+    if data.shape[1] < len(names):
+        missing = np.full((len(data), len(names) - data.shape[1]), np.nan)
+        data = np.hstack([data, missing])
+    dtype = np.dtype([(name, 'f8') for name in names])
+    table = recfunctions.unstructured_to_structured(data, dtype)
+
+    # Write to a temporary file first so a crash never leaves a half-written cache
+    tmp_file = cache_file + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        np.save(f, table)
+    os.replace(tmp_file, cache_file)
+
+
+def cache_path(data_file, cache_dir=CACHE_DIR):
+    '''Cache file for the current version of data_file (keyed by path, cache format, mtime and size)'''
+    path = os.path.abspath(data_file)
+    st = os.stat(path)
+    path_key = hashlib.sha1(path.encode()).hexdigest()[:8]
+    version_key = '{}-{}-{}'.format(CACHE_FORMAT, st.st_mtime_ns, st.st_size)
+    directory = os.path.join(os.path.dirname(path), cache_dir)
+    name = '{}-{}-{}.npy'.format(os.path.basename(path), path_key, version_key)
+    return os.path.join(directory, name)
+
+
+def load_run(data_file, cache_dir=CACHE_DIR):
+    '''Load a run data file as a memory-mapped structured array
+
+    The CSV is parsed once and cached as .npy in cache_dir next to it. The
+    cache is rebuilt whenever the file's mtime or size changes. Columns are
+    named after the file header ('time', 'box temp', ...) and indexing a
+    column returns a view, not a copy.
+    '''
+    cache_file = cache_path(data_file, cache_dir)
+    if not os.path.exists(cache_file):
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        # Drop caches of older versions of the same file
+        prefix = cache_file.rsplit('-', 3)[0]
+        for stale in glob.glob(glob.escape(prefix) + '-*.npy'):
+            os.remove(stale)
+        _convert(data_file, cache_file)
+    return np.load(cache_file, mmap_mode='r')
+
+
+def load_columns(data_file, *names):
+    '''Views of the named columns of a run data file'''
+    data = load_run(data_file)
+    return tuple(data[name] for name in names)
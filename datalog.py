@@ -0,0 +1,91 @@
+import os
+import time
+
+CSV_HEADER = 'time,control output,box humidity,box temp,outside humidity,outside temp,heater 1 temp,heater 2 temp,P,I,D,SP,Err'
+
+
+class RunLogger(object):
+    '''Append-only CSV logger for run data
+
+    Rows are written one at a time in the same format np.savetxt uses, so
+    the files stay readable by utils.plot_data and optimization.read_data_file.
+
+    data_file:       where to store the run data
+
+    header:          column names written as the first (commented) line
+
+    flush_interval:  seconds between flushes of the write buffer to the OS
+
+    fsync_interval:  seconds between fsyncs to the storage device (None to
+                     only fsync on rotation and close)
+
+    max_bytes:       rotate the file once it grows past this size (None to
+                     never rotate)
+
+    backups:         number of rotated files to keep (data.csv.1, ...)
+    '''
+    def __init__(self, data_file='data.csv', header=CSV_HEADER, flush_interval=5.0,
+                 fsync_interval=60.0, max_bytes=None, backups=5):
+        self.data_file = data_file
+        self.header = header
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.rows = 0
+        self._file = None
+        self._open()
+
+    def _open(self):
+        self._file = open(self.data_file, 'w')
+        self._file.write('# ' + self.header + '\n')
+        self._bytes = self._file.tell()
+        self._sync(fsync=True)
+
+    def _sync(self, fsync=False):
+        self._file.flush()
+        if fsync:
+            os.fsync(self._file.fileno())
+            self._last_fsync = time.monotonic()
+        self._last_flush = time.monotonic()
+
+    def _rotate(self):
+        '''Move the current file to data_file.1 and start a fresh one'''
+        self._sync(fsync=True)
+        self._file.close()
+        for n in range(self.backups - 1, 0, -1):
+            older = '{}.{}'.format(self.data_file, n)
+            if os.path.exists(older):
+                os.replace(older, '{}.{}'.format(self.data_file, n + 1))
+        if self.backups > 0:
+            os.replace(self.data_file, self.data_file + '.1')
+        self._open()
+
+    def append(self, row):
+        '''Append a single sample to the log'''
+        line = ','.join('%.18e' % v for v in row) + '\n'
+        self._file.write(line)
+        self._bytes += len(line)
+        self.rows += 1
+
+        now = time.monotonic()
+        if self.fsync_interval is not None and now - self._last_fsync >= self.fsync_interval:
+            self._sync(fsync=True)
+        elif now - self._last_flush >= self.flush_interval:
+            self._sync()
+
+        if self.max_bytes is not None and self._bytes >= self.max_bytes:
+            self._rotate()
+
+    def close(self):
+        if self._file is None or self._file.closed:
+            return
+        self._sync(fsync=True)
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
@@ -0,0 +1,94 @@
+import numpy as np
+
+
+def _segments(b):
+    '''start index and bucket number of each run of equal values in sorted b'''
+    starts = np.flatnonzero(np.r_[True, b[1:] != b[:-1]])
+    return starts, b[starts]
+
+
+def _first_match(y, values, b, starts):
+    '''index in each segment of the first y equal to that segment's value'''
+    lengths = np.diff(np.r_[starts, len(y)])
+    hits = np.flatnonzero(y == np.repeat(values, lengths))
+    _, first = np.unique(b[hits], return_index=True)
+    return hits[first]
+
+
+class _Extremes(object):
+    '''running first/last/min/max sample of every bucket of one series'''
+    def __init__(self, buckets):
+        self.first = np.full(buckets, -1)
+        self.last = np.full(buckets, -1)
+        self.min_idx = np.full(buckets, -1)
+        self.max_idx = np.full(buckets, -1)
+        self.min_val = np.full(buckets, np.inf)
+        self.max_val = np.full(buckets, -np.inf)
+
+    def update(self, y, b, starts, ub, offset):
+        ends = np.r_[starts[1:], len(y)] - 1
+        new = self.first[ub] < 0
+        self.first[ub[new]] = starts[new] + offset
+        self.last[ub] = ends + offset
+
+        # Missing (NaN) samples are never a bucket's min or max
+        missing = np.isnan(y)
+        low, high = np.where(missing, np.inf, y), np.where(missing, -np.inf, y)
+        mins = np.minimum.reduceat(low, starts)
+        better = mins < self.min_val[ub]
+        if better.any():
+            idx = _first_match(low, mins, b, starts) + offset
+            self.min_val[ub[better]] = mins[better]
+            self.min_idx[ub[better]] = idx[better]
+
+        maxs = np.maximum.reduceat(high, starts)
+        better = maxs > self.max_val[ub]
+        if better.any():
+            idx = _first_match(high, maxs, b, starts) + offset
+            self.max_val[ub[better]] = maxs[better]
+            self.max_idx[ub[better]] = idx[better]
+
+    def indices(self):
+        '''sorted indices of the kept samples'''
+        idx = np.concatenate([self.first, self.min_idx, self.max_idx, self.last])
+        return np.unique(idx[idx >= 0])
+
+
+def decimate(data, names, buckets, x='time', chunk_size=100000):
+    '''Reduce columns of a run to at most 4 samples per x bucket for plotting
+
+    data:        structured array or memmap of the run (e.g. datacache.load_run)
+
+    names:       the columns to reduce
+
+    buckets:     number of equal-width x buckets, normally the plot width in
+                 pixels
+
+    Keeps the first, last, minimum and maximum sample of every bucket, so
+    peaks and set point steps survive and the drawn line looks the same as
+    with every point. x must be increasing, as the time column of a run
+    log is. The data is read in chunks of chunk_size rows, so memory does
+    not grow with the run length and the points handed to matplotlib only
+    depend on buckets.
+
+    Returns {name: (x values, column values)}.
+    '''
+    n = len(data)
+    if n <= 4*buckets:
+        return {name: (np.asarray(data[x]), np.asarray(data[name])) for name in names}
+
+    x0, x1 = float(data[x][0]), float(data[x][-1])
+    scale = buckets/(x1 - x0) if x1 > x0 else 0
+    extremes = {name: _Extremes(buckets) for name in names}
+    for offset in range(0, n, chunk_size):
+        chunk = data[offset:offset + chunk_size]
+        b = np.minimum(((chunk[x] - x0)*scale).astype(int), buckets - 1)
+        starts, ub = _segments(b)
+        for name in names:
+            extremes[name].update(np.asarray(chunk[name], dtype=float), b, starts, ub, offset)
+
+    reduced = {}
+    for name in names:
+        idx = extremes[name].indices()
+        reduced[name] = (np.asarray(data[x][idx]), np.asarray(data[name][idx]))
+    return reduced
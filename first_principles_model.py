@@ -1,7 +1,20 @@
 import sys
 import numpy as np
-from scipy.optimize import minimize
-from scipy.integrate import odeint
+from scipy.optimize import least_squares
+from scipy.signal import lfilter
+from datalog import CSV_HEADER, RunLogger
+from recorder import RunRecorder
+from setpoints import MODEL_SCHEDULE, load_schedule
+from datacache import load_run
+
+# Box dimentions
+L = 0.24
+H = 0.07
+W = 0.15
+dens_air = 0.9815   # kg/m^3 ()
+m = dens_air*L*H*W     # kg
+Cp = 1.006 * 1000.0  # J/kg-K
+
 
 def first_principles(T, t, u, parameters, T_ambient):
     '''first-principles model for the system'''
@@ -9,40 +22,74 @@ def first_principles(T, t, u, parameters, T_ambient):
     # Appriximated parameters for the system
     UA, alpha = parameters
 
-    # Box dimentions
-    L = 0.24
-    H = 0.07
-    W = 0.15
-    dens_air = 0.9815   # kg/m^3 ()
-    m = dens_air*L*H*W     # kg
-    Cp = 1.006 * 1000.0  # J/kg-K
-    
     # Nonlinear Energy Balance
     dTdt = (1.0/(m*Cp))*((T_ambient - T)/UA + alpha*u)
     return dTdt
 
 
-def model_error(guesses, data_file):
-    '''find the total error in a first-principles simulation'''
-    total_err = 0
-    data = np.loadtxt(data_file, delimiter=',')
-    y0 = data[0][3]
-    for i, row in enumerate(data):
-        y_model = odeint(first_principles, y0, [0, 1], args=(
-            row[1], guesses, row[5]))
-        err = (y_model[-1] - row[3])**2
-        total_err += err
-        y0 = y_model[-1]
-    return total_err
+def simulate(u, T_ambient, parameters, T0, dt=1.0, sensitivities=False):
+    '''Simulate the first-principles model over a whole input record
+
+    The model is linear in T for a fixed u and T_ambient, so each step of
+    length dt has the exact solution T = T_ss + (T - T_ss)*exp(-dt/tau). The
+    recurrence over all steps runs as a single linear filter. Returns the
+    temperature at the end of each step, and with sensitivities=True also
+    its (n, 2) derivatives with respect to (UA, alpha).
+    '''
+    UA, alpha = parameters
+    u = np.asarray(u)
+    a = np.exp(-dt/(UA*m*Cp))
+    T_ss = np.asarray(T_ambient) + alpha*UA*u
+    T = lfilter([1 - a], [1, -a], T_ss, zi=[a*T0])[0]
+    if not sensitivities:
+        return T
+
+    T_prev = np.concatenate(([T0], T[:-1]))
+    da_dUA = a*dt/(m*Cp*UA**2)
+    forcing = np.array([da_dUA*(T_prev - T_ss) + (1 - a)*alpha*u,
+                        (1 - a)*UA*u])
+    sens = lfilter([1], [1, -a], forcing, axis=1)
+    return T, sens.T
+
+
+def load_data(data_file):
+    '''Read a run data file for fitting'''
+    return load_run(data_file)
+
+
+def model_residuals(guesses, data):
+    '''residuals of a first-principles simulation against the measured temperatures'''
+    T = data['box temp']
+    return simulate(data['control output'], data['outside temp'], guesses, T[0]) - T
+
+
+def model_jacobian(guesses, data):
+    '''Jacobian of model_residuals with respect to (UA, alpha)'''
+    T = data['box temp']
+    return simulate(data['control output'], data['outside temp'], guesses, T[0], sensitivities=True)[1]
+
+
+def model_error(guesses, data):
+    '''find the total error in a first-principles simulation
+
+    data is a loaded run (see load_data) or a data file name
+    '''
+    if isinstance(data, str):
+        data = load_data(data)
+    return np.sum(model_residuals(guesses, data)**2)
 
 
 def optimize_parameters(parameters=[95, 1.95e-3], data_file='data.csv'):
     '''optimize parameters for the first-principles model'''
-    sol = minimize(model_error, parameters, args=(data_file))
-    return {'UA': sol.x[0], 'alpha': sol.x[1], 'SSE': sol.fun}
+    data = load_data(data_file)
+    # UA and alpha are both physically non-negative
+    sol = least_squares(model_residuals, parameters, jac=model_jacobian,
+                        bounds=([1e-6, 0], [np.inf, np.inf]), x_scale='jac', args=(data,))
+    return {'UA': sol.x[0], 'alpha': sol.x[1], 'SSE': 2*sol.cost}
 
 
-def run_model(run_time, PID_parameters, FP_parameters, data_file='data.csv'):
+def run_model(run_time, PID_parameters, FP_parameters, data_file='data.csv', recorder=None,
+              setpoint=MODEL_SCHEDULE, headless=False, dt=1.0, progress_every=None):
     '''Run a controller on the first-principles model
 
     run_time:        total run time in minutes
@@ -51,49 +98,65 @@ def run_model(run_time, PID_parameters, FP_parameters, data_file='data.csv'):
     
     FP_parameters:   FP parameters as (UA, alpha)
     
-    data_file:       Where to store the run data
+    data_file:       Where to store the run data (None to not save it in
+                     headless mode)
+
+    recorder:        RunRecorder holding the most recent samples in memory
+
+    setpoint:        SetpointSchedule (or a file to load one from) giving the
+                     set point
+
+    headless:        Keep the run in memory and write it once at the end
+                     instead of printing and logging every step
+
+    dt:              Simulation time step in seconds
+
+    progress_every:  In headless mode, print a progress line every this
+                     many simulated seconds (None for no progress output)
+
+    Returns the recorder, or in headless mode a dict of the run data
+    columns as arrays.
     '''
     Kc, tau_I, tau_D = PID_parameters
-    # Bogus data row added to make concatenation work, never goes anywhere
-    data = [[0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 25, 0]]
-    csv_file_header = 'time,control output,box humidity,box temp,outside humidity,outside temp,heater 1 temp,heater 2 temp,P,I,D,SP,Err'
+    UA, alpha = FP_parameters
+    setpoint = load_schedule(setpoint)
+    n_steps = int(round(run_time*60/dt))
+    if headless:
+        data = np.empty((n_steps, len(CSV_HEADER.split(','))))
+        progress_steps = max(1, int(round(progress_every/dt))) if progress_every else None
+    else:
+        log = RunLogger(data_file)
+        if recorder is None:
+            recorder = RunRecorder()
 
     # Initialize variables
     u = 0
     Qss = 0  # 0% heater to start
-    i = 0
-    err = np.zeros(run_time*60)
-    sp = np.ones(run_time*60)*25
     err_sum = 0
     max_err_sum = 5
     current_time = 0
     prev_temp = 25
     new_temp = 25
-
-    # Set up the set point
-    sp[60:800] = 303.15 - 273.15  # 30 degrees C
-    sp[800:] = 298.15 - 273.15  # 25 degrees C
-    sp[1500:2100] = 310.15 - 273.15  # 37 degrees C
-    sp[2100:3000] = 307.15 - 273.15  # 34 degrees C
-    sp[3000:] = 300.15 - 273.15  # 27 degrees C
+    a = np.exp(-dt/(UA*m*Cp))  # Exact decay of the energy balance over one step
 
     # Main Loop
-    while current_time < run_time*60:
+    for i in range(n_steps):
         # read temp, humidity and time
         humid_in, temp_in = (0, new_temp)
         humid_out, temp_out = (0, 25)
-        current_time += 1  # Approximates the time change with 1 second
+        current_time += dt
 
-        err[i] = sp[i] - temp_in
-        ddt = temp_in - prev_temp
+        sp = setpoint(i*dt)
+        err = sp - temp_in
+        ddt = (temp_in - prev_temp)/dt
 
         # PID controller to determine u
-        P = Kc * err[i]
+        P = Kc * err
         I = Kc/tau_I * err_sum
         D = - Kc * tau_D * ddt
 
-        if (i > 60):
-            err_sum += err[i]
+        if (i*dt > 60):
+            err_sum += err*dt
 
         if err_sum > max_err_sum:
             err_sum = max_err_sum
@@ -103,20 +166,32 @@ def run_model(run_time, PID_parameters, FP_parameters, data_file='data.csv'):
         u = max(0, u)
         u = min(100, u)
 
-        new_temp = odeint(first_principles, prev_temp, [
-                    0, current_time - data[-1][0]], args=(u, FP_parameters, temp_out))[-1][0]
+        # Steady state for this heater output, approached exponentially
+        T_ss = temp_out + alpha*UA*u
+        new_temp = T_ss + (prev_temp - T_ss)*a
+
+        row = [current_time, u, humid_in,
+               temp_in, humid_out, temp_out, 0, 0, P, I, D, sp, err]
+        if headless:
+            data[i] = row
+            if progress_steps and i % progress_steps == 0:
+                print('time: {:.1f}, u: {:.2f} \tt_in: {:.2f}, SP: {:.2f}'.format(current_time, u, temp_in, sp))
+            continue
 
         # print current values
         print('time: {:.1f}, u: {:.2f} \tt_in: {:.2f}, t_out: {}, P: {:.2f}, I: {:.2f}, D: {:.2f} \tSP: {:.2f}, err: {:.2f}'
-                .format(current_time, u, temp_in, temp_out, P, I, D, sp[i], err[i]))
-        data = np.vstack([data, [current_time, u, humid_in,
-                                    temp_in, humid_out, temp_out, 0, 0, P, I, D, sp[i], err[i]]])
-        np.savetxt(data_file, data[1:],
-                    delimiter=',', header=csv_file_header)
-        i += 1
+                .format(current_time, u, temp_in, temp_out, P, I, D, sp, err))
+        recorder.append(row)
+        log.append(row)
+
+    if headless:
+        if data_file:
+            np.savetxt(data_file, data, delimiter=',', header=CSV_HEADER)
+        return dict(zip(CSV_HEADER.split(','), data.T))
 
+    log.close()
     print('Run Finished.')
-    return
+    return recorder
 
 
 if __name__ == '__main__':
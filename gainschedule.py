@@ -0,0 +1,63 @@
+import numpy as np
+import optimization as opt
+
+
+def imc_gains(Kp, tauP, thetaP):
+    '''IMC-style PID gains (K_c, tau_I, tau_D) for a FOPDT model'''
+    tau_c = max(tauP, 8*thetaP)
+    K_c = 1/Kp * (tauP + 0.5*thetaP) / (tau_c + thetaP)
+    tau_I = tauP + 0.5*thetaP
+    tau_D = tauP*thetaP / (2*tauP + thetaP)
+    return K_c, tau_I, tau_D
+
+
+class GainSchedule(object):
+    '''PID gains scheduled on the operating temperature
+
+    models:  sequence of (temperature, Kp, tauP, thetaP) FOPDT fits, each
+             made around the given box temperature
+
+    step:    spacing in degrees C of the precomputed table
+
+    tuning:  function giving (K_c, tau_I, tau_D) for (Kp, tauP, thetaP)
+
+    The model parameters are interpolated linearly between the operating
+    points (and held beyond them) onto a table every step degrees, and the
+    gains of every table row are computed up front. A lookup is an index
+    calculation and a linear interpolation between two rows, so it costs
+    the same however many bands there are.
+    '''
+    def __init__(self, models, step=0.25, tuning=imc_gains):
+        self.models = sorted(tuple(float(v) for v in m) for m in models)
+        self.step = step
+        temps, Kp, tauP, thetaP = np.array(self.models).T
+        self.T_min = temps[0]
+        n = max(int(np.ceil((temps[-1] - temps[0])/step)), 1) + 1
+        grid = self.T_min + step*np.arange(n)
+        params = [np.interp(grid, temps, p) for p in (Kp, tauP, thetaP)]
+        self.table = np.array([tuning(*p) for p in zip(*params)])
+
+    def __call__(self, T):
+        '''(K_c, tau_I, tau_D) at box temperature T'''
+        x = min(max((T - self.T_min)/self.step, 0), len(self.table) - 1)
+        k = min(int(x), len(self.table) - 2)
+        f = x - k
+        return tuple(float(g) for g in self.table[k]*(1 - f) + self.table[k + 1]*f)
+
+    @classmethod
+    def from_runs(cls, data_files, step=0.25):
+        '''Fit the FOPDT model to each run, taking its mean box temperature as the operating point'''
+        models = []
+        for data_file in data_files:
+            _, _, T = opt.read_data_file(data_file)
+            sol = opt.optimize_parameters(data_file, show_plot=False)
+            models.append((np.mean(T), sol['Kp'], sol['tauP'], sol['thetaP']))
+        return cls(models, step)
+
+    @classmethod
+    def from_file(cls, file_name, step=0.25):
+        '''Load the operating point models from a file of "temperature, Kp, tauP, thetaP" lines'''
+        return cls(np.atleast_2d(np.loadtxt(file_name, delimiter=',')), step)
+
+    def to_file(self, file_name):
+        np.savetxt(file_name, self.models, delimiter=',', header='temperature (degC), Kp, tauP, thetaP')
@@ -0,0 +1,210 @@
+import random
+import time
+import numpy as np
+import first_principles_model as fp
+from sensors import Reading, dht_sampler
+
+# Serial ports of the TCLab boards open in this process
+_open_ports = set()
+
+
+def _open_tclab(port):
+    '''Open the TCLab board on port ('' for the first one found)
+
+    tclab.TCLab allows one connection per process through a module-wide
+    flag. The boards here are kept to one connection per serial port
+    instead, so one process can run several enclosures.
+    '''
+    import tclab  # pip install tclab
+    from tclab import tclab as board
+
+    class PortTCLab(tclab.TCLab):
+        def connect(self, baud):
+            if self.port in _open_ports:
+                raise board.AlreadyConnectedError('TCLab on {} is already connected'.format(self.port))
+            board._connected = False
+            super(PortTCLab, self).connect(baud)
+            board._connected = False
+            _open_ports.add(self.port)
+
+        def close(self):
+            super(PortTCLab, self).close()
+            _open_ports.discard(self.port)
+
+    return PortTCLab(port)
+
+
+class TCLabBackend(object):
+    '''The enclosure hardware: TCLab heaters and the two DHT sensors on the Pi
+
+    Has the TCLab heater/LED interface plus read_inside() and read_outside(),
+    which return the latest sensor Reading without blocking.
+
+    port is the TCLab board's serial port, e.g. '/dev/ttyACM0', or '' for
+    the first board found. Several enclosures in one process each need
+    their own port and DHT pins.
+    '''
+    clock = staticmethod(time.monotonic)
+    sleep = staticmethod(time.sleep)
+
+    def __init__(self, inside_pin=4, outside_pin=17, port=''):
+        self.tc = _open_tclab(port)
+        self.sensor_in = dht_sampler(inside_pin).start()
+        self.sensor_out = dht_sampler(outside_pin).start()
+
+    def read_inside(self):
+        return self.sensor_in.latest()
+
+    def read_outside(self):
+        return self.sensor_out.latest()
+
+    def LED(self, value):
+        self.tc.LED(value)
+
+    def Q1(self, value):
+        self.tc.Q1(value)
+
+    def Q2(self, value):
+        self.tc.Q2(value)
+
+    @property
+    def T1(self):
+        return self.tc.T1
+
+    @property
+    def T2(self):
+        return self.tc.T2
+
+    def close(self):
+        self.sensor_in.stop()
+        self.sensor_out.stop()
+        # Turns the heaters off and releases the serial port
+        self.tc.close()
+
+
+class VirtualClock(object):
+    '''Clock that runs speedup times faster than real time
+
+    sleep() advances the clock by the requested time while only sleeping
+    1/speedup of it for real. With speedup=None it does not sleep at all.
+    '''
+    def __init__(self, speedup=100.0, start=0.0):
+        self.speedup = speedup
+        self.now = start
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        if seconds <= 0:
+            return
+        self.now += seconds
+        if self.speedup:
+            time.sleep(seconds/self.speedup)
+
+
+class ScaledClock(object):
+    '''Monotonic clock running speedup times faster than real time
+
+    Unlike VirtualClock it keeps running while nothing sleeps, so several
+    simulated enclosures driven by an asyncio host can share it.
+    '''
+    def __init__(self, speedup=1.0):
+        self.speedup = speedup
+        self.start = time.monotonic()
+
+    def __call__(self):
+        return (time.monotonic() - self.start)*self.speedup
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds/self.speedup)
+
+
+class SimulatedBackend(object):
+    '''Simulated enclosure with the same interface as TCLabBackend
+
+    The box temperature follows the first-principles model for the mean of
+    the two heater outputs. The DHT sensors report whole-number
+    temperatures and humidities like a DHT11, refresh at most every
+    sensor_interval seconds and drop a reading with probability dropout.
+    Time comes from a VirtualClock, so runs can go much faster than real
+    time.
+    '''
+    def __init__(self, FP_parameters=(94.999, 0.0024), T_ambient=22.0, humidity=(14.0, 16.0),
+                 speedup=100.0, dropout=0.05, sensor_interval=1.0, max_age=5.0, seed=None, clock=None):
+        self.UA, self.alpha = FP_parameters
+        self.T_ambient = T_ambient
+        self.humidity = humidity
+        self.dropout = dropout
+        self.sensor_interval = sensor_interval
+        self.max_age = max_age
+        self.clock = clock if clock is not None else VirtualClock(speedup)
+        self.sleep = self.clock.sleep
+        self.random = random.Random(seed)
+
+        self.T_box = T_ambient
+        self.heaters = [T_ambient, T_ambient]
+        self.u = [0.0, 0.0]
+        self.led = 0
+        self._updated = self.clock()
+        self._sensors = {'inside': (None, None, None, -np.inf), 'outside': (None, None, None, -np.inf)}
+
+    def _advance(self):
+        '''bring the simulated temperatures up to the current clock time'''
+        now = self.clock()
+        dt = now - self._updated
+        if dt <= 0:
+            return
+        self._updated = now
+        u = sum(self.u)/2
+        a = np.exp(-dt/(self.UA*fp.m*fp.Cp))
+        T_ss = self.T_ambient + self.alpha*self.UA*u
+        self.T_box = T_ss + (self.T_box - T_ss)*a
+        # Heater sinks run 0.5 degC per % above the box with a 30 s time constant
+        b = np.exp(-dt/30.0)
+        for n in range(2):
+            T_ss = self.T_box + 0.5*self.u[n]
+            self.heaters[n] = T_ss + (self.heaters[n] - T_ss)*b
+
+    def _read(self, name, temperature, humidity):
+        humid, temp, stamp, last_try = self._sensors[name]
+        now = self.clock()
+        if now - last_try >= self.sensor_interval:
+            last_try = now
+            if self.random.random() >= self.dropout:
+                humid, temp, stamp = float(round(humidity)), float(round(temperature)), now
+            self._sensors[name] = (humid, temp, stamp, last_try)
+        stale = stamp is None or now - stamp > self.max_age
+        return Reading(humid, temp, stamp, stale)
+
+    def read_inside(self):
+        self._advance()
+        return self._read('inside', self.T_box, self.humidity[0])
+
+    def read_outside(self):
+        return self._read('outside', self.T_ambient, self.humidity[1])
+
+    def LED(self, value):
+        self.led = value
+
+    def Q1(self, value):
+        self._advance()
+        self.u[0] = min(max(value, 0), 100)
+
+    def Q2(self, value):
+        self._advance()
+        self.u[1] = min(max(value, 0), 100)
+
+    @property
+    def T1(self):
+        self._advance()
+        return round(self.heaters[0], 2)
+
+    @property
+    def T2(self):
+        self._advance()
+        return round(self.heaters[1], 2)
+
+    def close(self):
+        pass
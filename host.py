@@ -0,0 +1,153 @@
+import argparse
+import asyncio
+import time
+from controller import Controller
+from hardware import ScaledClock, SimulatedBackend, TCLabBackend
+from scheduler import FixedRateScheduler
+
+
+class _Enclosure(object):
+    def __init__(self, name, loop, run_time, scheduler):
+        self.name = name
+        self.loop = loop
+        self.run_time = run_time
+        self.scheduler = scheduler
+        self.errors = 0
+        self.running = False
+
+
+class EnclosureHost(object):
+    '''Run the control loops of several enclosures in one process
+
+    Every enclosure's runs.PidLoop is an asyncio task ticking on its own
+    FixedRateScheduler. All schedulers share one clock and start time,
+    with the enclosures' deadlines staggered across the period so their
+    sensor reads and heater writes do not all land at once. Ticks run in
+    the event loop between sleeps, so a tick that blocks delays the others;
+    health() reports each enclosure's missed deadlines and jitter.
+
+    period:        seconds between control steps
+
+    overrun:       FixedRateScheduler policy for late steps
+
+    clock:         shared clock, e.g. a hardware.ScaledClock that simulated
+                   backends also use (time.monotonic by default)
+
+    report_every:  seconds between health reports (None for none)
+    '''
+    def __init__(self, period=1.0, overrun='skip', clock=None, report_every=60):
+        self.period = period
+        self.overrun = overrun
+        self.clock = clock if clock is not None else ScaledClock()
+        self.speedup = getattr(self.clock, 'speedup', 1.0)
+        self.report_every = report_every
+        self.enclosures = []
+
+    def add(self, name, controller, run_time, data_file=None, **kwargs):
+        '''add controller's enclosure to run for run_time minutes, logging to data_file (name.csv by default)
+
+        Other keyword arguments go to runs.PidLoop. The per-tick lines are
+        not printed unless a printer is given.
+        '''
+        kwargs.setdefault('printer', None)
+        loop = controller.loop(data_file=data_file or name + '.csv', period=self.period, **kwargs)
+        scheduler = FixedRateScheduler(self.period, overrun=self.overrun, clock=self.clock)
+        self.enclosures.append(_Enclosure(name, loop, run_time, scheduler))
+        return loop
+
+    async def _sleep(self, seconds):
+        await asyncio.sleep(max(seconds, 0)/self.speedup)
+
+    async def _run(self, enclosure):
+        loop, scheduler = enclosure.loop, enclosure.scheduler
+        loop.start()
+        enclosure.running = True
+        try:
+            while True:
+                await self._sleep(scheduler.advance())
+                i = scheduler.fire()
+                current_time = scheduler.elapsed()
+                try:
+                    loop.tick(i, current_time)
+                except ValueError as error:
+                    # Handles cases when the heater overheats
+                    enclosure.errors += 1
+                    print('{}: {}'.format(enclosure.name, error))
+                if current_time > enclosure.run_time*60:
+                    break
+        finally:
+            enclosure.running = False
+            loop.close()
+
+    async def _monitor(self):
+        while any(e.running for e in self.enclosures):
+            await self._sleep(self.report_every)
+            self.report()
+
+    async def _main(self):
+        start = self.clock()
+        n = len(self.enclosures)
+        for k, enclosure in enumerate(self.enclosures):
+            enclosure.scheduler.start = start + k*self.period/n
+        tasks = [asyncio.ensure_future(self._run(e)) for e in self.enclosures]
+        monitor = asyncio.ensure_future(self._monitor()) if self.report_every else None
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            if monitor:
+                monitor.cancel()
+
+    def run(self):
+        '''run every enclosure until its run time is up, returning health()'''
+        try:
+            asyncio.run(self._main())
+        except KeyboardInterrupt:
+            print('Exiting...')
+        self.report()
+        return self.health()
+
+    def health(self):
+        '''loop timing, stale readings and errors of every enclosure'''
+        health = {}
+        for e in self.enclosures:
+            stats = e.scheduler.stats()
+            phases = e.loop.timer.stats()
+            stats['tick_p95'] = phases['total']['p95'] if 'total' in phases else None
+            stats.update({'stale': e.loop.stale, 'errors': e.errors, 'running': e.running})
+            health[e.name] = stats
+        return health
+
+    def report(self):
+        for name, h in self.health().items():
+            print('{}: ticks {ticks}, missed {missed}, jitter mean {mean_jitter:.4f} s, max {max_jitter:.4f} s, '
+                  'stale {stale}, errors {errors}'.format(name, **h))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run several enclosures in one process')
+    parser.add_argument('enclosures', type=int, nargs='?', default=0, help='number of simulated enclosures')
+    parser.add_argument('--board', action='append', default=[], metavar='PORT,INSIDE_PIN,OUTSIDE_PIN',
+                        help='a TCLab enclosure, e.g. /dev/ttyACM0,4,17 (repeat for each box)')
+    parser.add_argument('--minutes', type=float, default=10, help='run time of each enclosure')
+    parser.add_argument('--speedup', type=float, default=60, help='simulated seconds per real second (real boards run in real time)')
+    args = parser.parse_args()
+
+    # Real boards run in real time
+    clock = ScaledClock(1.0 if args.board else args.speedup)
+    host = EnclosureHost(clock=clock, report_every=300)
+    backends = []
+    try:
+        for board in args.board:
+            port, inside_pin, outside_pin = board.split(',')
+            backends.append(TCLabBackend(int(inside_pin), int(outside_pin), port=port))
+            host.add(port.rsplit('/', 1)[-1], Controller(backends[-1]), args.minutes)
+        for n in range(args.enclosures):
+            controller = Controller(SimulatedBackend(clock=clock, seed=n))
+            host.add('box{}'.format(n), controller, args.minutes)
+        start = time.perf_counter()
+        host.run()
+        print('{} enclosures, {:.1f} s'.format(len(host.enclosures), time.perf_counter() - start))
+    finally:
+        # The loops leave backends they were given open
+        for backend in backends:
+            backend.close()
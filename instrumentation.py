@@ -0,0 +1,76 @@
+import json
+import time
+import numpy as np
+
+
+class PhaseTimer(object):
+    '''Time the phases of every loop tick with rolling statistics
+
+    Call start() at the top of a tick and mark(name) at the end of each
+    phase, which records the time since the previous mark. end() closes the
+    tick and records its total time. The last window durations of every
+    phase are kept, and every summary_every ticks the
+    p50/p95/max of each phase is printed as one line and, if metrics_file
+    is given, appended to it as a JSON line.
+
+    window:         durations kept per phase
+
+    summary_every:  ticks between summaries (None for no automatic summary)
+
+    metrics_file:   sidecar file for the JSON summaries
+
+    clock:          monotonic clock in seconds
+    '''
+    def __init__(self, window=600, summary_every=60, metrics_file=None, clock=time.perf_counter,
+                 printer=print):
+        self.window = window
+        self.summary_every = summary_every
+        self.metrics_file = metrics_file
+        self.clock = clock
+        self.printer = printer
+        self.ticks = 0
+        self._phases = {}
+        self._start = self._last = None
+
+    def start(self):
+        '''start timing a tick'''
+        self._start = self._last = self.clock()
+
+    def _record(self, name, seconds):
+        if name not in self._phases:
+            self._phases[name] = [np.zeros(self.window), 0]
+        phase = self._phases[name]
+        phase[0][phase[1] % self.window] = seconds
+        phase[1] += 1
+
+    def mark(self, name):
+        '''record the time since the last mark (or start) as phase name'''
+        now = self.clock()
+        self._record(name, now - self._last)
+        self._last = now
+
+    def end(self):
+        '''finish a tick, recording its total time and summarizing every summary_every ticks'''
+        self._record('total', self.clock() - self._start)
+        self.ticks += 1
+        if self.summary_every and self.ticks % self.summary_every == 0:
+            self.report()
+
+    def stats(self):
+        '''p50, p95 and max seconds of each phase over the window'''
+        stats = {}
+        for name, (durations, count) in self._phases.items():
+            recent = durations[:min(count, self.window)]
+            p50, p95 = np.percentile(recent, [50, 95])
+            stats[name] = {'p50': p50, 'p95': p95, 'max': recent.max(), 'count': count}
+        return stats
+
+    def report(self):
+        stats = self.stats()
+        self.printer('tick {} phases (ms p50/p95/max): '.format(self.ticks) + ', '.join(
+            '{} {:.2f}/{:.2f}/{:.2f}'.format(name, s['p50']*1e3, s['p95']*1e3, s['max']*1e3)
+            for name, s in stats.items()))
+        if self.metrics_file:
+            with open(self.metrics_file, 'a') as f:
+                f.write(json.dumps({'tick': self.ticks, 'time': time.time(), 'phases': stats}) + '\n')
+        return stats
@@ -0,0 +1,155 @@
+import multiprocessing
+import queue
+import time
+from collections import deque
+
+
+class LivePlot(object):
+    '''Live plot of run samples drawn by a separate process
+
+    panels:    list of subplots, each a list of the series names drawn in it,
+               e.g. [['box temp', 'SP'], ['P', 'I', 'D'], ['control output']]
+
+    window:    seconds of data shown (a sliding window)
+
+    interval:  minimum seconds between redraws
+
+    Samples are sent to the plotting process over a bounded queue. send()
+    never blocks: if the plot falls behind, samples are dropped. The plot
+    process only redraws the line artists (blitting over a cached
+    background) and does a full redraw only when the axes limits have to
+    move, so the cost per frame does not grow with the run length.
+    '''
+    def __init__(self, panels, window=600, interval=0.5, ylabels=None, maxsize=10000):
+        self.panels = panels
+        self.names = [name for panel in panels for name in panel]
+        # Fork where possible: spawn would re-run scripts like
+        # resources/generate_data.py that have no __main__ guard
+        methods = multiprocessing.get_all_start_methods()
+        ctx = multiprocessing.get_context('fork' if 'fork' in methods else 'spawn')
+        self.queue = ctx.Queue(maxsize)
+        self.dropped = 0
+        self.process = ctx.Process(target=_plot_process,
+                                   args=(self.queue, panels, window, interval, ylabels))
+        self.process.daemon = True
+
+    def start(self):
+        self.process.start()
+        return self
+
+    def send(self, t, values):
+        '''queue one sample: the time and a value for every series name, in order'''
+        try:
+            self.queue.put_nowait((t, tuple(values)))
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self, save_as=None, timeout=10):
+        '''stop the plot process, saving the figure first if save_as is given'''
+        if not self.process.is_alive():
+            return
+        self.queue.put(('save', save_as) if save_as else None)
+        if save_as:
+            self.queue.put(None)
+        self.process.join(timeout)
+
+
+def _plot_process(samples, panels, window, interval, ylabels):
+    import matplotlib.pyplot as plt
+
+    fig, axes = plt.subplots(len(panels), 1, figsize=(10, 7), sharex=True)
+    axes = axes if len(panels) > 1 else [axes]
+    lines, series = [], []
+    for n, (ax, names) in enumerate(zip(axes, panels)):
+        ax.grid()
+        if ylabels:
+            ax.set_ylabel(ylabels[n])
+        for name in names:
+            line, = ax.plot([], [], label=name, animated=True)
+            lines.append((ax, line))
+            series.append(deque())
+        ax.legend(loc='upper left')
+        ax.set_xlim(0, window)
+    axes[-1].set_xlabel('Time (sec)')
+    times = deque()
+    plt.show(block=False)
+
+    def redraw_all():
+        fig.canvas.draw()
+        background = fig.canvas.copy_from_bbox(fig.bbox)
+        for ax, line in lines:
+            ax.draw_artist(line)
+        fig.canvas.blit(fig.bbox)
+        return background
+
+    def update_lines():
+        '''give the lines the current data, returning whether the axes limits moved'''
+        rescale = False
+        t_end = times[-1]
+        if t_end > axes[0].get_xlim()[1]:
+            # Jump the window ahead by half its width so most frames only blit
+            for ax in axes:
+                ax.set_xlim(t_end - window/2, t_end + window/2)
+            rescale = True
+        for (ax, line), s in zip(lines, series):
+            line.set_data(times, s)
+            lo, hi = min(s), max(s)
+            y0, y1 = ax.get_ylim()
+            if lo < y0 or hi > y1:
+                pad = 0.1*max(hi - lo, 1)
+                ax.set_ylim(min(lo, y0) - pad, max(hi, y1) + pad)
+                rescale = True
+        return rescale
+
+    background = redraw_all()
+    last_draw = 0
+    running = True
+    while running:
+        save_as = None
+        try:
+            items = [samples.get(timeout=interval)]
+            while True:
+                items.append(samples.get_nowait())
+        except queue.Empty:
+            pass
+
+        for item in items:
+            if item is None:
+                running = False
+                break
+            if item[0] == 'save':
+                save_as = item[1]
+                continue
+            t, values = item
+            times.append(t)
+            for s, v in zip(series, values):
+                s.append(v)
+        # Drop samples that slid out of the window
+        while times and times[0] < times[-1] - window:
+            times.popleft()
+            for s in series:
+                s.popleft()
+
+        if save_as:
+            if times:
+                update_lines()
+            for ax, line in lines:
+                line.set_animated(False)
+            fig.savefig(save_as)
+            for ax, line in lines:
+                line.set_animated(True)
+
+        if not times or time.monotonic() - last_draw < interval:
+            fig.canvas.flush_events()
+            continue
+        last_draw = time.monotonic()
+
+        if update_lines():
+            background = redraw_all()
+        else:
+            fig.canvas.restore_region(background)
+            for ax, line in lines:
+                ax.draw_artist(line)
+            fig.canvas.blit(fig.bbox)
+        fig.canvas.flush_events()
+    plt.close(fig)
@@ -0,0 +1,124 @@
+from functools import lru_cache
+import numpy as np
+from scipy.linalg import cho_factor, cho_solve
+from scipy.optimize import lsq_linear
+from scipy.signal import lfilter
+
+
+@lru_cache(maxsize=16)
+def prediction_matrices(Kp, tauP, thetaP, period, horizon, block, moves, move_weight):
+    '''Step response matrices of a FOPDT model for FopdtMpc, cached per parameter set
+
+    Returns the rows (prediction steps) the cost is evaluated at, the
+    response B of those rows to each input move block, the stacked least
+    squares matrix of the tracking and move costs, and the Cholesky
+    factor of its normal equations.
+    '''
+    a = np.exp(-period/tauP)
+    b = Kp*(1 - a)
+    delay = int(round(thetaP/period))
+    steps = int(round(horizon/period))
+    rows = np.arange(block, steps + 1, block)
+
+    # Future input s enters the model at step delay + s; the last block is
+    # held to the end of the horizon
+    B = np.zeros((len(rows), moves))
+    for j in range(moves):
+        w = np.zeros(steps + delay + 1)
+        w[delay + j*block:delay + (j + 1)*block if j < moves - 1 else None] = 1
+        B[:, j] = lfilter([0, b], [1, -a], w)[rows]
+
+    # Move penalties on u[0] - u_prev, u[1] - u[0], ...
+    D = np.eye(moves) - np.eye(moves, k=-1)
+    A = np.vstack([B, np.sqrt(move_weight)*D])
+    return rows, B, A, cho_factor(A.T @ A)
+
+
+class FopdtMpc(object):
+    '''Model predictive control of the box temperature on a FOPDT model
+
+    FOPDT_parameters:  fitted (Kp, tauP, thetaP), e.g. from
+                       optimization.optimize_parameters
+
+    period:            seconds between control steps
+
+    horizon:           seconds the output is predicted over; it should
+                       cover the dead time and a few time constants
+
+    block:             seconds each future input move is held, also the
+                       spacing of the predictions in the cost
+
+    moves:             number of future moves (the last is held to the end
+                       of the horizon)
+
+    move_weight:       cost of a 1% change of heater output, relative to
+                       1 degC of tracking error at each prediction
+
+    bias_filter:       fraction of the measured model error taken into the
+                       output bias each step, which smooths the whole-degree
+                       sensor steps
+
+    Every step the model state is advanced with the applied input, the
+    bias between the measured and modelled temperature is updated, and
+    the heater outputs minimizing the predicted squared set point error
+    plus the move penalties are found within u_min to u_max. The matrices
+    only depend on the parameters and are cached by prediction_matrices,
+    so a step is the free response simulation and a solve with the cached
+    factorization, falling back to a bounded least squares solve of the
+    same small system when the unconstrained solution hits a limit.
+    '''
+    def __init__(self, FOPDT_parameters, period=1.0, horizon=900, block=15, moves=6, move_weight=1e-2,
+                 bias_filter=0.05, u_min=0, u_max=100):
+        self.Kp, self.tauP, self.thetaP = (float(p) for p in FOPDT_parameters)
+        self.period = period
+        self.u_min, self.u_max = u_min, u_max
+        self.bias_filter = bias_filter
+        self.rows, self.B, self.A, self.factor = prediction_matrices(
+            self.Kp, self.tauP, self.thetaP, period, horizon, block, moves, move_weight)
+        self.weight = np.sqrt(move_weight)
+        self.a = np.exp(-period/self.tauP)
+        self.b = self.Kp*(1 - self.a)
+        self.steps = int(round(horizon/period))
+
+        # Model output for the inputs so far and the inputs still in the dead time
+        self.x = 0.0
+        self.pending = np.zeros(int(round(self.thetaP/period)))
+        self.bias = None
+        self.u = 0.0
+        self.t = None
+
+    def _advance(self, u):
+        '''advance the model one period with input u applied'''
+        if len(self.pending):
+            u_delayed = self.pending[0]
+            self.pending[:-1] = self.pending[1:]
+            self.pending[-1] = u
+        else:
+            u_delayed = u
+        self.x = self.a*self.x + self.b*u_delayed
+
+    def free_response(self):
+        '''model output over the horizon if the heaters were turned off now'''
+        w = np.zeros(self.steps + len(self.pending) + 1)
+        w[:len(self.pending)] = self.pending
+        zero_state = lfilter([0, self.b], [1, -self.a], w)
+        return self.a**self.rows*self.x + zero_state[self.rows]
+
+    def control(self, t, y, reference):
+        '''heater output at t seconds for measured temperature y and set point function reference'''
+        if self.t is not None:
+            for _ in range(max(int(round((t - self.t)/self.period)), 0)):
+                self._advance(self.u)
+        self.t = t
+        if self.bias is None:
+            self.bias = y - self.x
+        self.bias += self.bias_filter*(y - self.x - self.bias)
+
+        r = np.array([reference(t + n*self.period) for n in self.rows])
+        target = np.concatenate([r - self.bias - self.free_response(), np.zeros(len(self.A) - len(r))])
+        target[len(r)] = self.weight*self.u
+        u = cho_solve(self.factor, self.A.T @ target)
+        if u.min() < self.u_min or u.max() > self.u_max:
+            u = lsq_linear(self.A, target, bounds=(self.u_min, self.u_max), method='bvls').x
+        self.u = float(np.clip(u[0], self.u_min, self.u_max))
+        return self.u
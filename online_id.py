@@ -0,0 +1,159 @@
+import numpy as np
+
+
+class OnlineFopdt(object):
+    '''Recursive FOPDT identification from the samples of a running loop
+
+    Every dead-time candidate d (in seconds) gets its own recursive least
+    squares fit, with exponential forgetting, of the discrete model
+
+        y[k+1] = a*y[k] + b*u[k - d/dt] + c
+
+    which is the exact sampled FOPDT with Kp = b/(1 - a) and
+    tauP = -dt/ln(a). The regressor uses each candidate's own model output
+    in place of the measured y[k] (output-error RLS), so the whole-degree
+    steps of the DHT11 readings do not bias the estimates. The candidate
+    with the lowest discounted prediction error gives the estimate. An
+    update is a fixed amount of work for the whole bank, independent of how
+    long the loop has run.
+
+    dt:          seconds between fit steps. A step several times the loop
+                 period keeps the temperature change per step well above
+                 the 1 degree resolution of the sensor
+
+    dead_times:  dead-time candidates in seconds
+
+    forgetting:  RLS forgetting factor, 0.999 remembers about 1000 steps
+
+    initial:     (Kp, tauP, thetaP) of a rough model to start the fits
+                 from, which the output-error regressors need
+
+    max_trace:   covariance trace above which forgetting is paused, so the
+                 fits do not wind up while the input is not exciting
+
+    excitation:  (grid steps, heater %, degC) window, input standard
+                 deviation and output range below which the fits are not
+                 updated. A loop settled at a steady output says nothing
+                 about the plant, and fitting it only drifts the estimates
+    '''
+    def __init__(self, dt=5.0, dead_times=np.arange(0, 301, 5), forgetting=0.999, initial=(0.29, 180, 0),
+                 delta=100.0, max_trace=1e4, excitation=(60, 2.0, 0.5)):
+        self.dt = dt
+        self.dead_times = np.asarray(dead_times, dtype=float)
+        self.delays = np.round(self.dead_times/dt).astype(int)
+        self.forgetting = forgetting
+        self.max_trace = max_trace
+        self.window, self.min_u_std, self.min_y_range = excitation
+
+        n = len(self.delays)
+        Kp, tauP, _ = initial
+        a = np.exp(-dt/tauP)
+        self.theta = np.tile([a, Kp*(1 - a), 0.0], (n, 1))
+        self.P = np.tile(delta*np.eye(3), (n, 1, 1))
+        self.err = np.zeros(n)
+        self.weight = 0.0
+
+        # Inputs of the last max delay + 1 (at least window) grid steps, newest last
+        self.u_hist = np.zeros(max(self.delays.max() + 1, self.window))
+        self.y_hist = np.zeros(self.window)
+        self.y_model = None
+        self.last = None
+        self.next_t = None
+        self.samples = 0
+
+    def update(self, t, u, y):
+        '''add a sample: the measured output y at time t and the input u applied after it
+
+        Samples do not have to be evenly spaced. The fits run on the means
+        of u (held between samples) and y (interpolated between samples)
+        over each dt grid step. Averaging rather than sampling matters in
+        closed loop, where the heater can switch every loop period as the
+        reading flips between two whole degrees.
+        '''
+        if self.last is None:
+            # Assume the input was steady at its first value before the run
+            self.u_hist[:] = u
+            self.y_hist[:] = y
+            self.y_model = np.full(len(self.delays), float(y))
+            # and the output settled there
+            self.theta[:, 2] = (1 - self.theta[:, 0])*y - self.theta[:, 1]*u
+            self.last = (t, u, y)
+            self.next_t = t + self.dt
+            self._sums = [0.0, 0.0]
+            return
+        t_last, u_last, y_last = self.last
+        span = t - t_last
+        start = t_last
+        while start < t:
+            end = min(self.next_t, t)
+            # Mean of the interpolated y over [start, end]
+            y_mid = y_last + (y - y_last)*((start + end)/2 - t_last)/span
+            self._sums[0] += u_last*(end - start)
+            self._sums[1] += y_mid*(end - start)
+            if end == self.next_t:
+                self.u_hist[:-1] = self.u_hist[1:]
+                self.u_hist[-1] = self._sums[0]/self.dt
+                self._regress(self._sums[1]/self.dt)
+                self._sums = [0.0, 0.0]
+                self.next_t += self.dt
+            start = end
+        self.last = (t, u, y)
+
+    def _regress(self, y):
+        lam = self.forgetting
+        phi = np.column_stack([self.y_model,
+                               self.u_hist[-1 - self.delays],
+                               np.ones(len(self.delays))])
+        self.y_hist[:-1] = self.y_hist[1:]
+        self.y_hist[-1] = y
+        if self.u_hist[-self.window:].std() < self.min_u_std and np.ptp(self.y_hist) < self.min_y_range:
+            # Not exciting: only run the models on
+            self.y_model = np.einsum('di,di->d', self.theta, phi)
+            return
+        P_phi = np.einsum('dij,dj->di', self.P, phi)
+        gain = P_phi/(lam + np.einsum('di,di->d', phi, P_phi))[:, None]
+        e = y - np.einsum('di,di->d', self.theta, phi)
+        self.theta += gain*e[:, None]
+        self.P -= gain[:, :, None]*P_phi[:, None, :]
+        forget = np.trace(self.P, axis1=1, axis2=2) < self.max_trace
+        self.P[forget] /= lam
+        self.err = lam*self.err + e**2
+        self.weight = lam*self.weight + 1
+        self.y_model = np.einsum('di,di->d', self.theta, phi)
+        self.samples += 1
+
+    def estimates(self):
+        '''current best (Kp, tauP, thetaP), its prediction error and standard errors
+
+        Kp, tauP and thetaP are None until a candidate gives a stable,
+        positive-gain model. Kp_std and tauP_std are first order standard
+        errors from the RLS covariance scaled by the prediction error.
+        '''
+        a, b, _ = self.theta.T
+        valid = (a > 0) & (a < 1) & (b > 0)
+        result = {'Kp': None, 'tauP': None, 'thetaP': None, 'error': None, 'samples': self.samples,
+                  'Kp_std': None, 'tauP_std': None}
+        if not self.samples or not valid.any():
+            return result
+        best = np.flatnonzero(valid)[np.argmin(self.err[valid])]
+        a, b, _ = self.theta[best]
+        error = self.err[best]/self.weight
+        cov = error*self.P[best, :2, :2]
+        dKp = np.array([b/(1 - a)**2, 1/(1 - a)])
+        dtauP = np.array([self.dt/(a*np.log(a)**2), 0])
+        result.update({
+            'Kp': float(b/(1 - a)),
+            'tauP': float(-self.dt/np.log(a)),
+            'thetaP': float(self.dead_times[best]),
+            'error': float(error),
+            'Kp_std': float(np.sqrt(max(dKp @ cov @ dKp, 0))),
+            'tauP_std': float(np.sqrt(max(dtauP @ cov @ dtauP, 0))),
+        })
+        return result
+
+    def confident(self, tolerance=0.25):
+        '''whether the current estimates are within tolerance (relative standard error)'''
+        est = self.estimates()
+        return (est['Kp'] is not None
+                and est['Kp_std'] < tolerance*est['Kp']
+                and est['tauP_std'] < tolerance*est['tauP'])
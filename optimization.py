@@ -1,17 +1,16 @@
+import os
 import numpy as np
 import matplotlib.pyplot as plt
-from scipy.integrate import odeint
-from scipy.optimize import minimize
-from scipy.interpolate import interp1d
+from concurrent.futures import ProcessPoolExecutor
+from scipy.optimize import least_squares
+from scipy.signal import lfilter
+from datacache import load_columns
 
 
 def read_data_file(file_name):
     '''Read in data from the given data file'''
-    data = np.loadtxt(file_name, delimiter=',', skiprows=1)
-    t = data[:, 0].T  # time array
-    u = data[:, 1].T
-    T = data[:, 3].T # temperature array
-    return (t, u, T)
+    # time, control output and temperature arrays
+    return load_columns(file_name, 'time', 'control output', 'box temp')
 
 
 def plot_results(t, T, T_fopdt, err_fopdt, u, save_as=''):
@@ -38,70 +37,230 @@ def plot_results(t, T, T_fopdt, err_fopdt, u, save_as=''):
     plt.show()
 
 
-def FOPDT(y, t, u, coeffs, time, y0, u_array):
-    '''Basic FOPDT model'''
+def simulate_fopdt(t, u, coeffs, y0, u0=None, dt=None, sensitivities=False):
+    '''Simulate a FOPDT model over a whole input record
+
+    Uses the exact zero-order-hold solution of the model on a uniform grid
+    of step dt (the median sample spacing by default). The dead time is a
+    shift of the input, which is held at u0 before the record starts. The
+    response is interpolated back onto the sample times t.
+
+    With sensitivities=True the derivatives of the response with respect to
+    (k, tau, theta) are returned as well, as an (n, 3) array. They come from
+    differentiating the same recurrence, so they are exact for the
+    discretized model.
+    '''
     k, tau, theta = coeffs
-    dydt = (-(y-y0) + k*(u(time-theta)-u_array[0])) / tau
-    # print(coeffs, dydt, u(t-theta), t, y)
-    return dydt
+    t = np.asarray(t, dtype=float)
+    u = np.asarray(u, dtype=float)
+    if u0 is None:
+        u0 = u[0]
+    if dt is None:
+        dt = np.median(np.diff(t))
+    grid = np.arange(t[0], t[-1] + dt, dt)
+    u_delayed = np.interp(grid - theta, t, u, left=u0) - u0
+    a = np.exp(-dt/tau)
+    y = lfilter([0, k*(1 - a)], [1, -a], u_delayed)
+    if not sensitivities:
+        return y0 + np.interp(t, grid, y)
+
+    # Slope of the interpolated input at the shifted times, zero where it is held
+    slopes = np.zeros(len(t) + 1)
+    spacing = np.diff(t)
+    np.divide(np.diff(u), spacing, out=slopes[1:-1], where=spacing > 0)
+    du_dtheta = -slopes[np.searchsorted(t, grid - theta, side='right')]
+
+    da_dtau = a*dt/tau**2
+    forcing = np.array([(1 - a)*u_delayed,
+                        da_dtau*(y - k*u_delayed),
+                        k*(1 - a)*du_dtheta])
+    sens = lfilter([0, 1], [1, -a], forcing, axis=1)
+    sens = np.array([np.interp(t, grid, s) for s in sens]).T
+    return y0 + np.interp(t, grid, y), sens
+
 
+def fopdt_residuals(guesses, t, u_array, T):
+    '''residuals of a FOPDT simulation against the measured temperatures'''
+    return simulate_fopdt(t, u_array, guesses, T[0]) - T
 
-def fopdt_err(guesses, u, T, t, u_array):
+
+def fopdt_jacobian(guesses, t, u_array, T):
+    '''Jacobian of fopdt_residuals with respect to (Kp, tauP, thetaP)'''
+    return simulate_fopdt(t, u_array, guesses, T[0], sensitivities=True)[1]
+
+
+def fopdt_err(guesses, t, u_array, T):
     '''find the total error in a FOPDT simulation'''
-    if guesses[0] <= 0 or guesses[1] < 0 or guesses[2] < 0:
-        return 1e20
-    total_err = 0
-    for i, y in enumerate(T):
-        y_fopdt = odeint(FOPDT, T[0], [0, 1], args=(u, guesses, t[i], T[0], u_array))[-1]
-        err = (y_fopdt - y)**2
-        total_err += err
-        y0_fopdt = y_fopdt
-    return total_err
-
-
-def optimize_parameters(data_file_path):
+    return np.sum(fopdt_residuals(guesses, t, u_array, T)**2)
+
+
+# Data shared with the dead time search worker processes
+_search_data = None
+
+
+def _init_search(t, u_array, T, guess):
+    global _search_data
+    _search_data = (t, u_array, T, guess)
+
+
+def _fit_dead_time(thetaP):
+    '''fit Kp and tauP with the dead time held at thetaP'''
+    t, u_array, T, guess = _search_data
+
+    def residuals(x):
+        return fopdt_residuals((x[0], x[1], thetaP), t, u_array, T)
+
+    def jacobian(x):
+        return fopdt_jacobian((x[0], x[1], thetaP), t, u_array, T)[:, :2]
+
+    sol = least_squares(residuals, guess, jac=jacobian, bounds=([1e-6, 1e-3], [np.inf, np.inf]),
+                        x_scale='jac')
+    return (thetaP, sol.x[0], sol.x[1], 2*sol.cost)
+
+
+def search_dead_time(t, u_array, T, dead_times=None, guess=(0.29, 180), processes=None):
+    '''Find the best FOPDT dead time by scanning a grid of candidates
+
+    For each candidate dead time Kp and tauP are fit by least squares, with
+    the candidates spread over a pool of processes (one per core by
+    default). Candidates default to every sample period up to half the
+    record length or 600 s.
+
+    Returns the best fit along with the cost profile as an array of
+    (thetaP, Kp, tauP, SSE) rows.
+    '''
+    t = np.asarray(t, dtype=float)
+    u_array = np.asarray(u_array, dtype=float)
+    T = np.asarray(T, dtype=float)
+    if dead_times is None:
+        step = max(np.median(np.diff(t)), 1.0)
+        dead_times = np.arange(0, min(0.5*(t[-1] - t[0]), 600), step)
+
+    processes = processes or os.cpu_count() or 1
+    chunksize = max(1, len(dead_times) // (4*processes))
+    with ProcessPoolExecutor(processes, initializer=_init_search,
+                             initargs=(t, u_array, T, guess)) as pool:
+        profile = np.array(list(pool.map(_fit_dead_time, dead_times, chunksize=chunksize)))
+
+    thetaP, Kp, tauP, SSE = profile[np.argmin(profile[:, 3])]
+    return {'Kp': Kp, 'tauP': tauP, 'thetaP': thetaP, 'SSE': SSE, 'profile': profile}
+
+
+class StreamingFit(object):
+    '''Refit the FOPDT model as samples arrive, tracking its confidence
+
+    Every refit_every seconds of data the model is refit by least squares
+    to all samples so far, starting from the previous solution, and the
+    standard errors of the parameters are estimated from the Jacobian at
+    the solution. The fit has converged once, for hold refits in a row,
+    Kp and tauP have relative standard errors below tolerance, thetaP is
+    known to within tolerance*tauP, no parameter moved by more than that
+    since the previous refit, and the record is longer than tauP + thetaP.
+    '''
+    def __init__(self, guess=(0.29, 180, 20), refit_every=30.0, tolerance=0.05, hold=3):
+        self.x = np.array(guess, dtype=float)
+        self.refit_every = refit_every
+        self.tolerance = tolerance
+        self.hold = hold
+        self.t, self.u, self.T = [], [], []
+        self.std = np.full(3, np.inf)
+        self.SSE = None
+        self.fits = 0
+        self.settled = 0
+        self._last_fit = None
+
+    def add(self, t, u, T):
+        '''add a sample, refitting if refit_every seconds passed since the last fit'''
+        self.t.append(t)
+        self.u.append(u)
+        self.T.append(T)
+        if self._last_fit is None:
+            self._last_fit = t
+        elif t - self._last_fit >= self.refit_every:
+            self.fit()
+
+    def fit(self):
+        '''refit to all samples so far and return the estimates'''
+        t, u, T = np.array(self.t), np.array(self.u), np.array(self.T)
+        self._last_fit = t[-1]
+        if len(t) < 4:
+            return self.estimates()
+        bounds = ([1e-6, 1e-3, 0], [np.inf, np.inf, t[-1] - t[0]])
+        sol = least_squares(fopdt_residuals, np.clip(self.x, *bounds), jac=fopdt_jacobian,
+                            bounds=bounds, x_scale='jac', args=(t, u, T))
+        # Parameter covariance from the Gauss-Newton approximation
+        dof = max(len(t) - 3, 1)
+        cov = 2*sol.cost/dof*np.linalg.pinv(sol.jac.T @ sol.jac)
+        std = np.sqrt(np.abs(np.diag(cov)))
+        moved = np.abs(sol.x - self.x)
+
+        Kp, tauP, thetaP = sol.x
+        limits = self.tolerance*np.array([Kp, tauP, tauP])
+        # Early in a step the response looks like a ramp, which fits just as
+        # well with any large Kp and tauP in proportion
+        seen = tauP + thetaP < t[-1] - t[0]
+        if seen and np.all(std < limits) and np.all(moved < limits):
+            self.settled += 1
+        else:
+            self.settled = 0
+        self.x, self.std, self.SSE = sol.x, std, float(2*sol.cost)
+        self.fits += 1
+        return self.estimates()
+
+    def converged(self):
+        return self.settled >= self.hold
+
+    def estimates(self):
+        '''latest Kp, tauP, thetaP, their standard errors and the SSE'''
+        Kp, tauP, thetaP = self.x
+        Kp_std, tauP_std, thetaP_std = self.std
+        return {'Kp': float(Kp), 'tauP': float(tauP), 'thetaP': float(thetaP), 'SSE': self.SSE,
+                'Kp_std': float(Kp_std), 'tauP_std': float(tauP_std), 'thetaP_std': float(thetaP_std)}
+
+
+def optimize_parameters(data_file_path, dead_time_search=False, processes=None, show_plot=True,
+                        initial_guess=None):
+    '''Fit FOPDT parameters to a run data file
+
+    initial_guess is the (Kp, tauP, thetaP) to start from, e.g. the last
+    good fit of the same enclosure, in place of the fixed guess values
+    below. With dead_time_search the initial guess comes from
+    search_dead_time, which scans dead times on a pool of processes.
+    show_plot=False skips simulating and plotting the fitted model.
+    '''
     t, u_array, T = read_data_file(data_file_path)
 
     # Convert T to Kelvin from Celsius
-    T = [v + 273.15 for v in T]
-
-    # Generate the interpolated control values as a function of time
-    u_i1d = interp1d(t, u_array, fill_value="extrapolate")
+    T = np.asarray(T) + 273.15
 
-    def u_interp(x):
-        if x < 0 or x > t[-1]:
-            return 0
-        return u_i1d(x) 
-    
     # Set the initial guess values
     Kp = 0.29      # degC/%
     tauP = 180   # seconds
     thetaP = 20   # seconds (integer)
+    if initial_guess is not None:
+        Kp, tauP, thetaP = initial_guess
 
-    # Optimize the FOPDT model
-    sol = minimize(fopdt_err, (Kp, tauP, thetaP), args=(u_interp, T, t, u_array))
-    print(sol)
-    Kp, tauP, thetaP = sol.x
-    err_fopdt = sol.fun
-
-    print('Optimized FOPDT Parameters: Kp: {}, tau_p: {}, thetaP: {}, err: {}'.format(Kp, tauP, thetaP, err_fopdt))
+    if dead_time_search:
+        search = search_dead_time(t, u_array, T, guess=(Kp, tauP), processes=processes)
+        Kp, tauP, thetaP = search['Kp'], search['tauP'], search['thetaP']
+        print('Dead time search: Kp: {}, tau_p: {}, thetaP: {}, err: {}'.format(Kp, tauP, thetaP, search['SSE']))
 
-    # Initialize lists
-    T_fopdt = [T[0]]        # temperature as predicted by standard FOPDT
-    err_fopdt = [0]
-
-    # Initialize holder variables
-    T_fopdt0 = T[0]
+    # Optimize the FOPDT model within physical bounds
+    bounds = ([1e-6, 1e-3, 0], [np.inf, np.inf, t[-1] - t[0]])
+    sol = least_squares(fopdt_residuals, np.clip((Kp, tauP, thetaP), *bounds), jac=fopdt_jacobian,
+                        bounds=bounds, x_scale='jac', args=(t, u_array, T))
+    print('{} ({} evaluations, {} jacobians)'.format(sol.message, sol.nfev, sol.njev))
+    Kp, tauP, thetaP = sol.x
+    SSE = 2*sol.cost
 
-    for i in range(1, len(t)):
-        dt = t[i] - t[i-1] # time step
-        T3_next = odeint(FOPDT, T_fopdt0, [0, 1], args=(u_interp, (Kp, tauP, thetaP), t[i], T[0], u_array))[-1]
-        T_fopdt.append(T3_next)
-        T_fopdt0 = T3_next
-        err_fopdt.append(err_fopdt[-1] + abs(T3_next - T[i]))
+    print('Optimized FOPDT Parameters: Kp: {}, tau_p: {}, thetaP: {}, err: {}'.format(Kp, tauP, thetaP, SSE))
 
-    plot_results(t, T, T_fopdt, err_fopdt, u_array, 'optimized_run.png')
-    return {'Kp': Kp, 'tauP': tauP, 'thetaP': thetaP, 'SSE': err_fopdt}
+    if show_plot:
+        # Simulate the fitted model for the plot
+        T_fopdt = simulate_fopdt(t, u_array, (Kp, tauP, thetaP), T[0])
+        err_fopdt = np.cumsum(np.abs(T_fopdt - T))
+        plot_results(t, T, T_fopdt, err_fopdt, u_array, 'optimized_run.png')
+    return {'Kp': Kp, 'tauP': tauP, 'thetaP': thetaP, 'SSE': SSE}
 
 
 if __name__ == '__main__':
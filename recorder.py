@@ -0,0 +1,82 @@
+import numpy as np
+from datalog import CSV_HEADER
+
+RUN_DTYPE = np.dtype([(name, 'f8') for name in CSV_HEADER.split(',')])
+
+
+class RunRecorder(object):
+    '''Fixed-size in-memory record of the most recent run samples
+
+    Samples are kept in a structured ring buffer, so memory use does not
+    depend on how long the run is. Every sample is written twice (at i and
+    i + capacity), which keeps the newest `capacity` samples contiguous and
+    lets latest() hand out views instead of copies.
+
+    capacity:    number of samples kept in memory
+
+    spill_file:  optional binary file the full history is appended to in
+                 chunks (read it back with load_spill)
+
+    chunk_size:  samples per spill write, at most capacity
+    '''
+    def __init__(self, capacity=3600, spill_file=None, chunk_size=600, dtype=RUN_DTYPE):
+        if chunk_size > capacity:
+            raise ValueError('chunk_size must not be larger than capacity')
+        self.capacity = capacity
+        self.dtype = dtype
+        self.columns = dtype.names
+        self.count = 0
+        self.chunk_size = chunk_size
+        self._buf = np.zeros(2*capacity, dtype=dtype)
+        self._spilled = 0
+        self._spill = open(spill_file, 'wb') if spill_file else None
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, row):
+        '''Record one sample, given as a sequence in column order'''
+        i = self.count % self.capacity
+        self._buf[i] = self._buf[i + self.capacity] = tuple(row)
+        self.count += 1
+        if self._spill is not None and self.count - self._spilled >= self.chunk_size:
+            self._flush_spill()
+
+    def latest(self, n=None):
+        '''View of the newest n samples (all that are held by default), oldest first'''
+        held = len(self)
+        n = held if n is None else min(n, held)
+        end = self.count if self.count <= self.capacity else self.count % self.capacity + self.capacity
+        return self._buf[end - n:end]
+
+    def column(self, name, n=None):
+        '''View of a single column of the newest n samples'''
+        return self.latest(n)[name]
+
+    def last(self):
+        '''The most recent sample'''
+        return self.latest(1)[0]
+
+    def _flush_spill(self):
+        pending = self.count - self._spilled
+        if pending:
+            self.latest(pending).tofile(self._spill)
+            self._spill.flush()
+            self._spilled = self.count
+
+    def close(self):
+        if self._spill is not None and not self._spill.closed:
+            self._flush_spill()
+            self._spill.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def load_spill(spill_file, dtype=RUN_DTYPE):
+    '''Memory-map the full history written by a RunRecorder spill file'''
+    return np.memmap(spill_file, dtype=dtype, mode='r')
@@ -1,8 +1,11 @@
+import os
+import sys
 import tclab  # pip install tclab
 import numpy as np
-import time
-import matplotlib.pyplot as plt
-from scipy.integrate import odeint
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from scheduler import FixedRateScheduler
+from liveplot import LivePlot
 
 
 
@@ -41,29 +44,21 @@ if __name__ == '__main__':
 
 
     # Create plot
-    plt.figure(figsize=(10, 7))
-    plt.ion()
-    plt.show()
+    plot = LivePlot([['T1', 'SP'], ['P', 'I', 'D'], ['Q']], window=n,
+                    ylabels=['Temperature (C)', 'Parameters', 'Heater output']).start()
 
     # Main Loop
-    start_time = time.time()
-    prev_time = start_time
+    scheduler = FixedRateScheduler(1.0)
+    scheduler.wait()
 
     err_sum = 0
     try:
         for i in range(1, n):
-            # Sleep time
-            sleep_max = 1.0
-            sleep = sleep_max - (time.time() - prev_time)
-            if sleep >= 0.01:
-                time.sleep(sleep-0.01)
-            else:
-                time.sleep(0.01)
+            # Wait for the next 1 second tick
+            scheduler.wait()
 
             # Record time and change in time
-            tn = time.time()
-            prev_time = tn
-            t[i] = tn - start_time
+            t[i] = scheduler.elapsed()
             ddt = t[i] - t[i-1]
 
             # Read temperatures in Kelvin
@@ -88,33 +83,15 @@ if __name__ == '__main__':
             err_sum += err[i]
 
             # Plot
-            plt.clf()
-            ax = plt.subplot(3, 1, 1)
-            ax.grid()
-            plt.plot(t[0:i], T1[0:i], 'ro')
-            plt.plot(t[0:i], sp[0:i], 'b-')
-            plt.ylabel('Temperature (C)')
-            ax = plt.subplot(3, 1, 2)
-            ax.grid()
-            plt.plot(t[0:i], P_array[0:i], 'k-', label='P')
-            plt.plot(t[0:i], I_array[0:i], 'b-', label='I')
-            plt.plot(t[0:i], D_array[0:i], 'r-', label='D')
-            plt.ylabel('Parameters')
-            plt.legend()
-            ax = plt.subplot(3, 1, 3)
-            ax.grid()
-            plt.plot(t[0:i], u[0:i], 'r-', label=r'$Q$')
-            plt.ylabel('Heater output')
-            plt.xlabel('Time (sec)')
-            plt.draw()
-            plt.pause(0.05)
+            plot.send(t[i], (T1[i], sp[i], P, I, D, u[i]))
 
         # Turn off heaters
         a.Q1(0)
         a.Q2(0)
+        print(scheduler.summary())
         # Save text file
         # Save figure
-        plt.savefig('control.eps', format='eps', dpi=1000)
+        plot.close(save_as='control.eps')
 
     # Allow user to end loop with Ctrl-C
     except KeyboardInterrupt:
@@ -123,7 +100,7 @@ if __name__ == '__main__':
         a.Q2(0)
         print('Shutting down')
         a.close()
-        plt.savefig('control.eps', format='eps', dpi=1000)
+        plot.close(save_as='control.eps')
 
     # Make sure serial connection still closes when there's an error
     except:
@@ -132,5 +109,5 @@ if __name__ == '__main__':
         a.Q2(0)
         print('Error: Shutting down')
         a.close()
-        plt.savefig('control.eps', format='eps', dpi=1000)
+        plot.close(save_as='control.eps')
         raise
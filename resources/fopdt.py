@@ -1,8 +1,7 @@
 import numpy as np
 import matplotlib.pyplot as plt
-from scipy.integrate import odeint
+from scipy.signal import lfilter
 from scipy.optimize import minimize
-from scipy.interpolate import interp1d
 
 # Import CSV data file
 # Column 1 = time (t)
@@ -18,30 +17,6 @@ yp = data[:,2].T
 # specify number of steps
 ns = len(t)
 delta_t = t[1]-t[0]
-# create linear interpolation of the u data versus time
-uf = interp1d(t,u)
-
-# define first-order plus dead-time approximation    
-def fopdt(y,t,uf,Km,taum,thetam):
-    # arguments
-    #  y      = output
-    #  t      = time
-    #  uf     = input linear function (for time shift)
-    #  Km     = model gain
-    #  taum   = model time constant
-    #  thetam = model time constant
-    # time-shift u
-    try:
-        if (t-thetam) <= 0:
-            um = uf(0.0)
-        else:
-            um = uf(t-thetam)
-    except:
-        #print('Error with time extrapolation: ' + str(t))
-        um = u0
-    # calculate derivative
-    dydt = (-(y-yp0) + Km * (um-u0))/taum
-    return dydt
 
 # simulate FOPDT model with x=[Km,taum,thetam]
 def sim_model(x):
@@ -49,15 +24,12 @@ def sim_model(x):
     Km = x[0]
     taum = x[1]
     thetam = x[2]
-    # storage for model values
-    ym = np.zeros(ns)  # model
-    # initial condition
-    ym[0] = yp0
-    # loop through time steps    
-    for i in range(0,ns-1):
-        ts = [t[i],t[i+1]]
-        y1 = odeint(fopdt,ym[i],ts,args=(uf,Km,taum,thetam))
-        ym[i+1] = y1[-1]
+    # time-shift u by the dead time, holding u0 before the data starts
+    um = np.interp(t - thetam, t, u, left=u0) - u0
+    # exact zero-order-hold solution of the first-order model, evaluated
+    # over every time step at once as a linear filter
+    a = np.exp(-delta_t/taum)
+    ym = yp0 + lfilter([0, Km*(1 - a)], [1, -a], um)
     return ym
 
 # define objective
@@ -108,7 +80,5 @@ plt.ylabel('Output')
 plt.legend(loc='best')
 plt.subplot(2,1,2)
 plt.plot(t,u,'bx-',linewidth=2)
-plt.plot(t,uf(t),'r--',linewidth=3)
-plt.legend(['Measured','Interpolated'],loc='best')
 plt.ylabel('Input Data')
 plt.show()
\ No newline at end of file
@@ -1,9 +1,13 @@
+import os
+import sys
 import tclab  # pip install tclab
 import numpy as np
-import time
-import matplotlib.pyplot as plt
 from scipy.integrate import odeint
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from scheduler import FixedRateScheduler
+from liveplot import LivePlot
+
 # FOPDT model
 Kp = 0.5      # degC/%
 tauP = 120.0  # seconds
@@ -84,28 +88,22 @@ print('{:6.1f} {:6.2f} {:6.2f} {:6.2f} {:6.2f}'.format(tm[0],
                                                        T2[0]))
 
 # Create plot
-plt.figure(figsize=(10, 7))
-plt.ion()
-plt.show()
+plot = LivePlot([[r'$T_1$ measured', r'$T_1$ energy balance', r'$T_1$ FOPDT', r'$T_2$ measured'],
+                 ['Energy Balance', 'Linear'],
+                 [r'$Q_1$', r'$Q_2$']], window=loops,
+                ylabels=['Temperature (degC)', 'Cumulative Error', 'Heaters']).start()
 
 # Main Loop
-start_time = time.time()
-prev_time = start_time
+scheduler = FixedRateScheduler(1.0)
+scheduler.wait()
 try:
     for i in range(1, loops):
-        # Sleep time
-        sleep_max = 1.0
-        sleep = sleep_max - (time.time() - prev_time)
-        if sleep >= 0.01:
-            time.sleep(sleep-0.01)
-        else:
-            time.sleep(0.01)
+        # Wait for the next 1 second tick
+        scheduler.wait()
 
         # Record time and change in time
-        t = time.time()
-        dt = t - prev_time
-        prev_time = t
-        tm[i] = t - start_time
+        tm[i] = scheduler.elapsed()
+        dt = tm[i] - tm[i-1]
 
         # Read temperatures in Kelvin
         T1[i] = a.T1
@@ -135,38 +133,16 @@ try:
                                                                T2[i]))
 
         # Plot
-        plt.clf()
-        ax = plt.subplot(3, 1, 1)
-        ax.grid()
-        plt.plot(tm[0:i], T1[0:i], 'ro', label=r'$T_1$ measured')
-        plt.plot(tm[0:i], Tp[0:i], 'k-', label=r'$T_1$ energy balance')
-        plt.plot(tm[0:i], Tpl[0:i], 'g:', label=r'$T_1$ FOPDT')
-        plt.plot(tm[0:i], T2[0:i], 'bx', label=r'$T_2$ measured')
-        plt.ylabel('Temperature (degC)')
-        plt.legend(loc=2)
-        ax = plt.subplot(3, 1, 2)
-        ax.grid()
-        plt.plot(tm[0:i], error_eb[0:i], 'k-', label='Energy Balance')
-        plt.plot(tm[0:i], error_fopdt[0:i], 'g:', label='Linear')
-        plt.ylabel('Cumulative Error')
-        plt.legend(loc='best')
-        ax = plt.subplot(3, 1, 3)
-        ax.grid()
-        plt.plot(tm[0:i], Q1[0:i], 'r-', label=r'$Q_1$')
-        plt.plot(tm[0:i], Q2[0:i], 'b:', label=r'$Q_2$')
-        plt.ylabel('Heaters')
-        plt.xlabel('Time (sec)')
-        plt.legend(loc='best')
-        plt.draw()
-        plt.pause(0.05)
+        plot.send(tm[i], (T1[i], Tp[i], Tpl[i], T2[i], error_eb[i], error_fopdt[i], Q1[i], Q2[i]))
 
     # Turn off heaters
     a.Q1(0)
     a.Q2(0)
+    print(scheduler.summary())
     # Save text file
     save_txt(tm[0:i], Q1[0:i], Q2[0:i], T1[0:i], T2[0:i], Tsp1[0:i], Tsp2[0:i])
     # Save figure
-    plt.savefig('test_Models.eps', format='eps', dpi=1000)
+    plot.close(save_as='test_Models.eps')
 
 # Allow user to end loop with Ctrl-C
 except KeyboardInterrupt:
@@ -176,7 +152,7 @@ except KeyboardInterrupt:
     print('Shutting down')
     a.close()
     save_txt(tm[0:i], Q1[0:i], Q2[0:i], T1[0:i], T2[0:i], Tsp1[0:i], Tsp2[0:i])
-    plt.savefig('test_Models.eps', format='eps', dpi=1000)
+    plot.close(save_as='test_Models.eps')
 
 # Make sure serial connection still closes when there's an error
 except:
@@ -186,5 +162,5 @@ except:
     print('Error: Shutting down')
     a.close()
     save_txt(tm[0:i], Q1[0:i], Q2[0:i], T1[0:i], T2[0:i], Tsp1[0:i], Tsp2[0:i])
-    plt.savefig('test_Models.eps', format='eps', dpi=1000)
+    plot.close(save_as='test_Models.eps')
     raise
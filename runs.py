@@ -1,174 +1,305 @@
-import tclab
-import time
-import numpy as np
-import sys
-import first_principles_model as fp
+from datalog import RunLogger
+from recorder import RunRecorder
+from hardware import TCLabBackend
+from instrumentation import PhaseTimer
+from liveplot import LivePlot
+from scheduler import FixedRateScheduler
+from setpoints import CONTROLLER_SCHEDULE, load_schedule
 
 
-def doublet_test(data_file='step_test.csv', show_plot=True):
-    '''doublet test the system and save data to given file path'''
-    import Adafruit_DHT # Only importable on the Pi itself
+def doublet_test(data_file='step_test.csv', show_plot=True, period=1.0, backend=None, fit=None):
+    '''doublet test the system and save data to given file path, sampling every period seconds
 
-    tc1 = tclab.TCLab()
-    tc1.LED(100)
-    # Bogus data row added to make concatenation work, never goes anywhere
-    data = [1, 1, 1, 1, 1, 1, 1, 1]
-    csv_file_header = 'time,control output,box humidity,box temp,outside humidity,outside temp,heater 1 temp,heater 2 temp,P,I,D,SP,Err'
+    backend is the hardware to run on, the Pi's TCLab and DHT sensors by
+    default or e.g. a hardware.SimulatedBackend. A backend passed in is
+    left open for the caller to reuse.
+
+    fit is an optional optimization.StreamingFit given every sample. The
+    test stops as soon as its estimates converge.
 
-    start_time = time.time()
+    Returns the test length in seconds.
+    '''
+    tc1 = backend if backend is not None else TCLabBackend()
+    tc1.LED(100)
+    log = RunLogger(data_file)
+    scheduler = FixedRateScheduler(period, clock=tc1.clock, sleep=tc1.sleep)
 
     u = 0
     tc1.Q1(u)
     tc1.Q2(u)
     current_time = 0
-    while current_time < 1200:
-        try:
-            # read temp, humidity and time
-            humid_in, temp_in = Adafruit_DHT.read_retry(
-                11, 4, retries=5, delay_seconds=1)
-            humid_out, temp_out = Adafruit_DHT.read_retry(
-                11, 17, retries=5, delay_seconds=1)
-            current_time = time.time() - start_time
-
-            if humid_in is None:
-                # Rejects failed readings
-                continue
-
-            if humid_in > 100:
-                # Corrupted data, so ignore it
-                continue
-
-            if current_time > 60:
-                u = 100
-
-            if current_time > 800:
-                u = 50
-
-            tc1.Q1(u)
-            tc1.Q2(u)
-
-            # print current values
-            print('time: {:.1f}, u: {}, h_in: {}, t_in: {}, h1: {}, h2: {}, h_out: {}, t_out: {}'
-                    .format(current_time, u, humid_in, temp_in, tc1.T1, tc1.T2, humid_out, temp_out))
-            data = np.vstack([data, [current_time, u, humid_in,
-                                        temp_in, humid_out, temp_out, tc1.T1, tc1.T2]])
-            np.savetxt(data_file, data[1:],
-                        delimiter=',', header=csv_file_header)
-
-        except KeyboardInterrupt:
-            print('Exiting...')
-            tc1.LED(0)
-            return 
-        except ValueError as error:
-            # Handles cases when the heater overheats
-            print(error)
-
-def run_controller(run_time, PID_parameters, show_plot=True):
+    try:
+        while current_time < 1200:
+            try:
+                scheduler.wait()
+                # read the latest temp and humidity from the samplers
+                humid_in, temp_in, _, stale_in = tc1.read_inside()
+                humid_out, temp_out, _, stale_out = tc1.read_outside()
+                current_time = scheduler.elapsed()
+
+                if stale_in or stale_out:
+                    # No recent good reading
+                    continue
+
+                if current_time > 60:
+                    u = 100
+
+                if current_time > 800:
+                    u = 50
+
+                tc1.Q1(u)
+                tc1.Q2(u)
+
+                # print current values
+                print('time: {:.1f}, u: {}, h_in: {}, t_in: {}, h1: {}, h2: {}, h_out: {}, t_out: {}'
+                        .format(current_time, u, humid_in, temp_in, tc1.T1, tc1.T2, humid_out, temp_out))
+                log.append([current_time, u, humid_in,
+                            temp_in, humid_out, temp_out, tc1.T1, tc1.T2])
+                if fit is not None:
+                    fit.add(current_time, u, temp_in)
+                    if fit.converged():
+                        print('FOPDT estimates converged after {:.0f} s'.format(current_time))
+                        break
+
+            except KeyboardInterrupt:
+                print('Exiting...')
+                break
+            except ValueError as error:
+                # Handles cases when the heater overheats
+                print(error)
+    finally:
+        # Never leave the heaters on, whether the test ran out, converged or failed
+        tc1.Q1(0)
+        tc1.Q2(0)
+        tc1.LED(0)
+        if backend is None:
+            tc1.close()
+        log.close()
+    print(scheduler.summary())
+    return current_time
+
+
+class PidLoop(object):
+    '''One enclosure's PID loop, run a tick at a time
+
+    tick() reads the sensors, sets the heaters and logs one sample. It is
+    what runs.run_controller calls on every deadline, and what host.py
+    schedules for each of several enclosures in one process.
+
+    PID_parameters	(K_c, tau_I, tau_D)
+    backend		hardware to run on, the Pi's TCLab and DHT sensors by default
+    data_file		where to store the run data
+    recorder		RunRecorder holding the most recent samples in memory
+    period		seconds between control steps
+    setpoint		SetpointSchedule (or a file to load one from) giving the set point
+    metrics_file	sidecar file for the per-phase tick timing summaries
+    identifier		online_id.OnlineFopdt updated with every sample
+    plot		LivePlot to send every sample to
+    printer		function printing the per-tick lines (None for quiet)
+    gain_schedule	gainschedule.GainSchedule giving the gains at the set point,
+    			in place of the fixed PID_parameters
+    mpc			mpc.FopdtMpc that sets the heaters in place of the PID
+    '''
+    def __init__(self, PID_parameters, backend=None, data_file='data.csv', recorder=None, period=1.0,
+                 setpoint=CONTROLLER_SCHEDULE, metrics_file=None, identifier=None, plot=None,
+                 printer=print, gain_schedule=None, mpc=None):
+        self.Kc, self.tau_I, self.tau_D = PID_parameters
+        self.setpoint = load_schedule(setpoint)
+        # Only a backend created here is closed with the loop
+        self.owns_backend = backend is None
+        self.backend = backend if backend is not None else TCLabBackend()
+        self.log = RunLogger(data_file)
+        self.recorder = recorder if recorder is not None else RunRecorder()
+        self.period = period
+        self.timer = PhaseTimer(metrics_file=metrics_file, printer=printer or (lambda line: None))
+        self.identifier = identifier
+        self.plot = plot
+        self.printer = printer
+        self.gain_schedule = gain_schedule
+        if gain_schedule is not None:
+            # Start on the scheduled gains rather than switching to them on the first tick
+            self.Kc, self.tau_I, self.tau_D = gain_schedule(self.setpoint(0))
+        self.mpc = mpc
+        self.stale = 0
+        # Whether an output has been applied, which set_gains has to keep
+        self.applied = False
+
+        self.u = 0
+        self.Qss = 0  # 0% heater to start
+        self.integral_err_sum = 0
+        self.u_max = 100
+        self.u_min = 0
+        self.prev_temp = 0
+        self.prev_time = 0
+
+    def start(self):
+        self.backend.LED(100)
+        self.backend.Q1(self.u)
+        self.backend.Q2(self.u)
+        return self
+
+    def set_gains(self, gains, err=0):
+        '''Switch to new (K_c, tau_I, tau_D) without a bump in the output
+
+        The integral is rescaled so that P + I at the current error is the
+        same with the new gains as with the old ones. Before any output has
+        been applied there is nothing to keep, so the gains are just set.
+        '''
+        Kc, tau_I, tau_D = gains
+        if (Kc, tau_I, tau_D) == (self.Kc, self.tau_I, self.tau_D):
+            return
+        if self.applied:
+            PI = self.Kc*err + self.Kc/self.tau_I*self.integral_err_sum
+            self.integral_err_sum = (PI - Kc*err)*tau_I/Kc
+        self.Kc, self.tau_I, self.tau_D = Kc, tau_I, tau_D
+
+    def tick(self, i, current_time):
+        '''run control step i at current_time seconds, returning the logged row (None on stale readings)'''
+        tc1, timer = self.backend, self.timer
+        timer.start()
+        # read the latest temp and humidity from the samplers
+        humid_in, temp_in, _, stale_in = tc1.read_inside()
+        humid_out, temp_out, _, stale_out = tc1.read_outside()
+        dtime = current_time - self.prev_time
+        timer.mark('sensors')
+
+        if stale_in or stale_out:
+            # No recent good reading
+            self.stale += 1
+            return None
+
+        if self.mpc is not None:
+            return self._finish(i, current_time, self.mpc.control(i*self.period, temp_in, self.setpoint),
+                                humid_in, temp_in, humid_out, temp_out, 0, 0, 0)
+
+        # PID controller to determine u
+        if self.printer:
+            self.printer("i", i)
+
+        sp = self.setpoint(i*self.period)
+        err = sp - temp_in
+        if i > 10:
+            self.integral_err_sum = self.integral_err_sum + err * dtime
+        if self.gain_schedule is not None:
+            self.set_gains(self.gain_schedule(sp), err)
+
+        if self.printer:
+            self.printer("error", err)
+
+        ddt = temp_in - self.prev_temp
+
+        P = self.Kc * err
+        I = self.Kc/self.tau_I * self.integral_err_sum
+        D = - self.Kc * self.tau_D * ddt
+
+        self.prev_temp = temp_in
+
+        u = (self.Qss + P + I + D) * 100
+
+        if i > 10:
+
+            if u > self.u_max:
+                u = self.u_max
+                self.integral_err_sum = self.integral_err_sum - err * dtime
+            if u < self.u_min:
+                u = self.u_min
+                self.integral_err_sum = self.integral_err_sum - err * dtime
+
+        self.prev_time = current_time
+        return self._finish(i, current_time, u, humid_in, temp_in, humid_out, temp_out, P, I, D)
+
+    def _finish(self, i, current_time, u, humid_in, temp_in, humid_out, temp_out, P, I, D):
+        '''set the heaters to u and log the tick'''
+        tc1, timer = self.backend, self.timer
+        sp = self.setpoint(i*self.period)
+        err = sp - temp_in
+        self.u = u
+        timer.mark('mpc' if self.mpc is not None else 'pid')
+        # Set the heater outputs
+        tc1.Q1(u)
+        tc1.Q2(u)
+        self.applied = True
+        h1, h2 = tc1.T1, tc1.T2
+        timer.mark('tclab')
+
+        # print current values
+        if self.printer:
+            self.printer('time: {:.1f}, u: {}, h_in: {}, t_in: {}, h1: {}, h2: {}, h_out: {}, t_out: {}, P: {:.2f}, I: {:.2f}, D: {:.2f}'
+                         .format(current_time, u, humid_in, temp_in, h1, h2, humid_out, temp_out, P, I, D))
+        timer.mark('print')
+        row = [current_time, u, humid_in,
+               temp_in, humid_out, temp_out, h1, h2, P, I, D, sp, err]
+        self.recorder.append(row)
+        self.log.append(row)
+        if self.plot:
+            self.plot.send(current_time, (temp_in, sp, P, I, D, u))
+        timer.mark('log')
+        if self.identifier is not None:
+            # The heaters clamp u to 0-100 even before the loop limits it
+            self.identifier.update(current_time, min(max(u, self.u_min), self.u_max), temp_in)
+            timer.mark('identify')
+        timer.end()
+        return row
+
+    def close(self):
+        self.backend.LED(0)
+        if self.owns_backend:
+            self.backend.close()
+        self.log.close()
+        if self.plot:
+            self.plot.close()
+
+
+def run_controller(run_time, PID_parameters, show_plot=True, data_file='data.csv', recorder=None,
+                   period=1.0, overrun='skip', setpoint=CONTROLLER_SCHEDULE, backend=None,
+                   metrics_file=None, identifier=None, gain_schedule=None, mpc=None):
     '''
     Run the main loop
     run_time		total run time in minutes
     show_plot		whether to show the dynamic plot of the system
+    data_file		where to store the run data
+    recorder		RunRecorder holding the most recent samples in memory
+    period		seconds between control steps
+    overrun		FixedRateScheduler policy for steps that run past their deadline
+    setpoint		SetpointSchedule (or a file to load one from) giving the set point
+    backend		hardware to run on, the Pi's TCLab and DHT sensors by default
+    			(a backend passed in is left open for the caller to reuse)
+    metrics_file	sidecar file for the per-phase tick timing summaries
+    identifier		online_id.OnlineFopdt updated with every sample, whose
+    			estimates() can be read while the loop runs
+    gain_schedule	gainschedule.GainSchedule to look the gains up in by set point
+    mpc			mpc.FopdtMpc to control with instead of the PID
+
+    Returns the recorder.
     '''
-    Kc, tau_I, tau_D = PID_parameters
-    import Adafruit_DHT  # Only importable on the Pi itself
-
-    tc1 = tclab.TCLab()
-    tc1.LED(100)
-    # Bogus data row added to make concatenation work, never goes anywhere
-    data = [1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1]
-    csv_file_header = 'time,control output,box humidity,box temp,outside humidity,outside temp,heater 1 temp,heater 2 temp,P,I,D,SP,Err'
-
-    start_time = time.time()
-
-    u = 0
-    Qss = 0  # 0% heater to start
-    err = np.zeros(run_time*60)
-    sp = np.ones(run_time*60)*25
-    # Set up the set point
-    sp[10:300] = 303.15 - 273.15  # 30 degrees C
-    sp[300:550] = 298.15 - 273.15  # 25 degrees C
-    sp[550:800] = 310.15 - 273.15  # 37 degrees C
-    sp[800:3000] = 307.15 - 273.15  # 34 degrees C
-    sp[3000:] = 300.15 - 273.15  # 27 degrees C
-    integral_err_sum = 0
-    u_max = 100
-    u_min = 0
-    prev_temp = 0
-    prev_time = start_time
-
-    i = 0
-
-    tc1.Q1(u)
-    tc1.Q2(u)
+    plot = None
+    if show_plot:
+        plot = LivePlot([['box temp', 'SP'], ['P', 'I', 'D'], ['control output']],
+                        ylabels=['Temperature (C)', 'PID terms', 'Heater output (%)']).start()
+    loop = PidLoop(PID_parameters, backend=backend, data_file=data_file, recorder=recorder,
+                   period=period, setpoint=setpoint, metrics_file=metrics_file,
+                   identifier=identifier, plot=plot, gain_schedule=gain_schedule, mpc=mpc).start()
+    tc1 = loop.backend
+    scheduler = FixedRateScheduler(period, overrun=overrun, clock=tc1.clock, sleep=tc1.sleep)
 
     while True:
         try:
-            # read temp, humidity and time
-            humid_in, temp_in = Adafruit_DHT.read_retry(
-                11, 4, retries=5, delay_seconds=1)
-            humid_out, temp_out = Adafruit_DHT.read_retry(
-                11, 17, retries=5, delay_seconds=1)
-            current_time = time.time() - start_time
-            dtime = current_time - prev_time
-
-            if (humid_in is None) or (humid_out is None):
-                # Rejects failed readings
-                continue
-
-            if humid_in > 100:
-                # Corrupted data, so ignore it
-                continue
-
-            # PID controller to determine u
-            print("i", i)
-
-            err[i] = sp[i] - temp_in
-            if i > 10:
-                integral_err_sum = integral_err_sum + err[i] * dtime
-
-            print("error", err[i])
-
-            ddt = temp_in - prev_temp
-
-            P = Kc * err[i]
-            I = Kc/tau_I * integral_err_sum
-            D = - Kc * tau_D * ddt
-
-            prev_temp = temp_in
-
-            u = (Qss + P + I + D) * 100
-
-            if i > 10:
-
-                if u > u_max:
-                    u = u_max
-                    integral_err_sum = integral_err_sum - err[i] * dtime
-                if u < u_min:
-                    u = u_min
-                    integral_err_sum = integral_err_sum - err[i] * dtime
-
-            i += 1
-            prev_time = current_time
-            # Set the heater outputs
-            tc1.Q1(u)
-            tc1.Q2(u)
-
-            # print current values
-            print('time: {:.1f}, u: {}, h_in: {}, t_in: {}, h1: {}, h2: {}, h_out: {}, t_out: {}, P: {:.2f}, I: {:.2f}, D: {:.2f}'
-                    .format(current_time, u, humid_in, temp_in, tc1.T1, tc1.T2, humid_out, temp_out, P, I, D, sp[i], err))
-            data = np.vstack([data, [current_time, u, humid_in,
-                                        temp_in, humid_out, temp_out, tc1.T1, tc1.T2, P, I, D, sp[i], err[i]]])
-            np.savetxt('data.csv', data[1:],
-                        delimiter=',', header=csv_file_header)
+            i = scheduler.wait()
+            current_time = scheduler.elapsed()
+            loop.tick(i, current_time)
+            # Checked on stale ticks too, so the run ends even without readings
             if current_time > run_time*60:
                 print('Run finished. Exiting...')
-                tc1.LED(0)
-                return
+                break
 
         except KeyboardInterrupt:
             print('Exiting...')
-            tc1.LED(0)
-            return
+            break
         except ValueError as error:
             # Handles cases when the heater overheats
             print(error)
+    loop.close()
+    print(scheduler.summary())
+    if loop.timer.ticks:
+        loop.timer.report()
+    return loop.recorder
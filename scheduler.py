@@ -0,0 +1,98 @@
+import math
+import time
+
+
+class FixedRateScheduler(object):
+    '''Fire loop ticks on absolute deadlines of a monotonic clock
+
+    Tick k is due at start + k*period, so the loop rate does not drift with
+    the time each tick takes. The lateness of every tick (jitter) and the
+    number of missed deadlines are recorded.
+
+    period:     seconds between ticks
+
+    overrun:    what to do when a tick runs past one or more deadlines,
+                'skip' jumps to the most recent deadline (the tick index
+                still counts the missed ones), 'catch_up' fires the missed
+                ticks back to back
+
+    clock:      monotonic clock in seconds
+
+    sleep:      function used to wait for the next deadline
+    '''
+    def __init__(self, period=1.0, overrun='skip', clock=time.monotonic, sleep=time.sleep):
+        if overrun not in ('skip', 'catch_up'):
+            raise ValueError("overrun must be 'skip' or 'catch_up'")
+        self.period = period
+        self.overrun = overrun
+        self.clock = clock
+        self.sleep = sleep
+        self.start = None
+        self.tick = -1
+        self.ticks = 0
+        self.missed = 0
+        self.last_jitter = 0.0
+        self.max_jitter = 0.0
+        self._jitter_sum = 0.0
+
+    def deadline(self, k):
+        '''absolute clock time tick k is due'''
+        return self.start + k*self.period
+
+    def elapsed(self):
+        '''seconds since the first tick'''
+        return self.clock() - self.start
+
+    def advance(self):
+        '''Move to the next deadline and return the seconds until it is due
+
+        Together with fire() this is wait() for loops that do their own
+        waiting, e.g. with asyncio.sleep.
+        '''
+        if self.start is None:
+            self.start = self.clock()
+            self.tick = 0
+            return 0.0
+        self.tick += 1
+        now = self.clock()
+        late = int(math.floor((now - self.deadline(self.tick)) / self.period))
+        if late > 0 and self.overrun == 'skip':
+            self.missed += late
+            self.tick += late
+        elif late > 0:
+            self.missed += 1
+        return self.deadline(self.tick) - self.clock()
+
+    def fire(self):
+        '''Record the lateness of the current tick and return its index'''
+        jitter = self.clock() - self.deadline(self.tick)
+        self.last_jitter = jitter
+        self.max_jitter = max(self.max_jitter, jitter)
+        self._jitter_sum += jitter
+        self.ticks += 1
+        return self.tick
+
+    def wait(self):
+        '''Sleep until the next deadline and return its tick index'''
+        remaining = self.advance()
+        if remaining > 0:
+            self.sleep(remaining)
+        return self.fire()
+
+    def __iter__(self):
+        while True:
+            yield self.wait()
+
+    def stats(self):
+        '''loop timing statistics so far'''
+        return {
+            'period': self.period,
+            'ticks': self.ticks,
+            'missed': self.missed,
+            'mean_jitter': self._jitter_sum / self.ticks if self.ticks else 0.0,
+            'max_jitter': self.max_jitter,
+            'last_jitter': self.last_jitter,
+        }
+
+    def summary(self):
+        return 'ticks: {ticks}, missed deadlines: {missed}, jitter mean: {mean_jitter:.4f} s, max: {max_jitter:.4f} s'.format(**self.stats())
@@ -0,0 +1,92 @@
+import threading
+import time
+from collections import namedtuple
+
+# Latest value published by a sampler. stale is True when there has not been
+# a good reading within max_age seconds (humidity/temperature are then the
+# last good values, or None if there never was one).
+Reading = namedtuple('Reading', ['humidity', 'temperature', 'timestamp', 'stale'])
+
+
+class SensorSampler(object):
+    '''Read a sensor on a background thread and publish the latest good value
+
+    read:       function returning (humidity, temperature), either may be None
+
+    interval:   seconds to wait between reads
+
+    max_age:    seconds after which the latest value is reported as stale
+
+    clock:      monotonic clock used for the timestamps
+    '''
+    def __init__(self, read, interval=1.0, max_age=5.0, clock=time.monotonic, name='sensor'):
+        self.read = read
+        self.interval = interval
+        self.max_age = max_age
+        self.clock = clock
+        self.name = name
+        self.failures = 0
+        self._value = (None, None, None)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name=self.name)
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 1)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.sample()
+            self._stop.wait(self.interval)
+
+    def sample(self):
+        '''Take one reading and publish it if it is good'''
+        try:
+            humidity, temperature = self.read()
+        except (RuntimeError, OSError):
+            humidity, temperature = None, None
+
+        if humidity is None or temperature is None or humidity > 100:
+            # Rejects failed and corrupted readings
+            self.failures += 1
+            return False
+
+        with self._lock:
+            self._value = (humidity, temperature, self.clock())
+        return True
+
+    def latest(self):
+        '''Latest good reading, returns immediately'''
+        with self._lock:
+            humidity, temperature, timestamp = self._value
+        stale = timestamp is None or self.clock() - timestamp > self.max_age
+        return Reading(humidity, temperature, timestamp, stale)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+
+def dht_sampler(pin, sensor=11, **kwargs):
+    '''SensorSampler for a DHT sensor on the given GPIO pin'''
+    import Adafruit_DHT  # Only importable on the Pi itself
+
+    def read():
+        return Adafruit_DHT.read_retry(sensor, pin, retries=5, delay_seconds=1)
+
+    kwargs.setdefault('name', 'dht-{}'.format(pin))
+    return SensorSampler(read, **kwargs)
@@ -0,0 +1,84 @@
+from bisect import bisect_right
+
+
+class SetpointSchedule(object):
+    '''Piecewise set point schedule keyed by elapsed seconds
+
+    points:   sequence of (time, value) or (time, value, kind) breakpoints.
+              A 'step' breakpoint (the default) jumps to value at time, a
+              'ramp' breakpoint ramps linearly from the previous breakpoint
+              so it reaches value at time.
+
+    initial:  set point before the first breakpoint
+
+    Lookups bisect the breakpoint times, so the schedule takes the same
+    memory however long the run is.
+    '''
+    def __init__(self, points, initial=25):
+        points = sorted((tuple(p) + ('step',))[:3] for p in points)
+        for p in points:
+            if p[2] not in ('step', 'ramp'):
+                raise ValueError("unknown breakpoint kind '{}'".format(p[2]))
+        self.initial = initial
+        self.times = [float(p[0]) for p in points]
+        self.values = [float(p[1]) for p in points]
+        self.kinds = [p[2] for p in points]
+
+    def __call__(self, t):
+        '''set point at t seconds into the run'''
+        k = bisect_right(self.times, t) - 1
+        if k + 1 < len(self.times) and self.kinds[k + 1] == 'ramp':
+            t0, v0 = (self.times[k], self.values[k]) if k >= 0 else (0.0, self.initial)
+            t1, v1 = self.times[k + 1], self.values[k + 1]
+            return v0 + (v1 - v0) * (t - t0) / (t1 - t0)
+        if k < 0:
+            return self.initial
+        return self.values[k]
+
+    def __len__(self):
+        return len(self.times)
+
+    @classmethod
+    def from_file(cls, file_name, initial=25):
+        '''Load a schedule from a file of "time, value[, ramp]" lines ('#' starts a comment)'''
+        points = []
+        with open(file_name) as f:
+            for line in f:
+                line = line.split('#')[0].strip()
+                if not line:
+                    continue
+                fields = [v.strip() for v in line.split(',')]
+                points.append((float(fields[0]), float(fields[1])) + tuple(fields[2:3]))
+        return cls(points, initial)
+
+    def to_file(self, file_name):
+        with open(file_name, 'w') as f:
+            f.write('# time (s), set point (degC), kind\n')
+            for point in zip(self.times, self.values, self.kinds):
+                f.write('{}, {}, {}\n'.format(*point))
+
+
+def load_schedule(setpoint):
+    '''Return setpoint as a schedule, loading it first if it is a file name'''
+    if isinstance(setpoint, str):
+        return SetpointSchedule.from_file(setpoint)
+    return setpoint
+
+
+# Set point profile used on the hardware by runs.run_controller
+CONTROLLER_SCHEDULE = SetpointSchedule([
+    (10, 303.15 - 273.15),    # 30 degrees C
+    (300, 298.15 - 273.15),   # 25 degrees C
+    (550, 310.15 - 273.15),   # 37 degrees C
+    (800, 307.15 - 273.15),   # 34 degrees C
+    (3000, 300.15 - 273.15),  # 27 degrees C
+])
+
+# Set point profile used for simulations by fp.run_model
+MODEL_SCHEDULE = SetpointSchedule([
+    (60, 303.15 - 273.15),    # 30 degrees C
+    (800, 298.15 - 273.15),   # 25 degrees C
+    (1500, 310.15 - 273.15),  # 37 degrees C
+    (2100, 307.15 - 273.15),  # 34 degrees C
+    (3000, 300.15 - 273.15),  # 27 degrees C
+])
@@ -0,0 +1,85 @@
+import os
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+import batchsim
+from setpoints import CONTROLLER_SCHEDULE, load_schedule
+
+# Weights of the closed-loop metrics in the tuning cost. One degree C of
+# overshoot costs as much as a minute spent one degree off the set point.
+COST_WEIGHTS = {'IAE': 1.0, 'ITAE': 0.0, 'overshoot': 60.0, 'effort': 0.1}
+
+
+def tuning_cost(metrics, weights=COST_WEIGHTS):
+    '''weighted closed-loop cost of each simulated loop'''
+    return sum(w*metrics[name] for name, w in weights.items() if w)
+
+
+def _evaluate(args):
+    '''cost of a chunk of candidate gains on a FOPDT plant'''
+    gains, FOPDT_parameters, T0, run_time, setpoint, dt, weights, law = args
+    plant = batchsim.FopdtPlant(FOPDT_parameters, T0=T0)
+    result = batchsim.simulate_pid(gains, plant, run_time, setpoint=setpoint, dt=dt, trajectories=False,
+                                   law=law)
+    return tuning_cost(result['metrics'], weights)
+
+
+def _candidates(center, spread, n, rng):
+    '''log-spaced random gains around center, with tau_D allowed to reach 0'''
+    Kc, tau_I, tau_D = center
+    scale = np.exp(rng.uniform(-np.log(spread), np.log(spread), size=(n, 2)))
+    D_max = max(tau_D, 10.0)*min(spread, 2.0)
+    return np.column_stack([Kc*scale[:, 0], tau_I*scale[:, 1],
+                            np.clip(tau_D + rng.uniform(-D_max, D_max, n), 0, None)])
+
+
+def tune_pid(FOPDT_parameters, initial_gains, run_time=60, setpoint=CONTROLLER_SCHEDULE, T0=25, dt=1.0,
+             n_candidates=2000, rounds=3, weights=COST_WEIGHTS, processes=None, seed=0, law='hardware'):
+    '''Search PID gains against a simulated closed-loop cost
+
+    FOPDT_parameters:  fitted (Kp, tauP, thetaP) used as the plant
+
+    initial_gains:     (K_c, tau_I, tau_D) to start the search from
+
+    Each round evaluates n_candidates random gains around the current best
+    (within 10x on the first round, narrowing after) with
+    batchsim.simulate_pid, split across a pool of processes. The weights
+    combine the closed-loop metrics into a single cost. law is the
+    simulated controller (see simulate_pid); 'hardware' scores the gains
+    with the control law runs.PidLoop will run them with, on the set point
+    profile it runs by default.
+
+    Returns the best gains, their cost and metrics, and the time spent.
+    '''
+    start = time.perf_counter()
+    setpoint = load_schedule(setpoint)
+    rng = np.random.RandomState(seed)
+    processes = processes or os.cpu_count() or 1
+
+    best = np.asarray(initial_gains, dtype=float)
+    best_cost = np.inf
+    spread = 10.0
+    evaluated = 0
+    with ProcessPoolExecutor(processes) as pool:
+        for _ in range(rounds):
+            gains = np.vstack([best, _candidates(best, spread, n_candidates - 1, rng)])
+            chunks = np.array_split(gains, processes)
+            costs = np.concatenate(list(pool.map(_evaluate, [
+                (chunk, FOPDT_parameters, T0, run_time, setpoint, dt, weights, law) for chunk in chunks])))
+            evaluated += len(gains)
+            if costs.min() < best_cost:
+                best, best_cost = gains[np.argmin(costs)], costs.min()
+            spread = np.sqrt(spread)
+
+    plant = batchsim.FopdtPlant(FOPDT_parameters, T0=T0)
+    metrics = batchsim.simulate_pid(best, plant, run_time, setpoint=setpoint, dt=dt, trajectories=False,
+                                    law=law)['metrics']
+    return {
+        'K_c': best[0],
+        'Tau_I': best[1],
+        'Tau_D': best[2],
+        'cost': best_cost,
+        'metrics': {name: value[0] for name, value in metrics.items()},
+        'evaluated': evaluated,
+        'tuning_time': time.perf_counter() - start,
+    }
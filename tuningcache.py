@@ -0,0 +1,132 @@
+import hashlib
+import json
+import os
+import time
+import numpy as np
+import optimization as opt
+import first_principles_model as fp
+
+
+def fingerprint(data_file):
+    '''hash of a data file's contents'''
+    digest = hashlib.sha1()
+    with open(data_file, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class TuningCache(object):
+    '''Fitted model and PID parameters of each enclosure, kept in a JSON file
+
+    Entries are keyed by an enclosure (or heater) ID and hold the last
+    good FOPDT and first-principles fits, each with the fingerprint of the
+    data it was fit to and its RMS error, and the PID gains in use.
+
+    Fitting a file that matches the stored fingerprint returns the stored
+    fit without refitting. Other data is fit starting from the stored
+    parameters, unless they fit the new data more than max_drift times
+    worse (in RMS error) than they fit their own data. In that case the
+    entry has expired, and the model is refit from the default guesses.
+    RMS errors below min_rms, half the sensor's 1 degC resolution, are
+    taken as min_rms so a near-perfect fit cannot expire on noise alone.
+    '''
+    def __init__(self, path='tuning_cache.json', max_drift=1.5, min_rms=0.5):
+        self.path = path
+        self.max_drift = max_drift
+        self.min_rms = min_rms
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    def _save(self):
+        # Write to a temporary file first so a crash never leaves a half-written cache
+        tmp_file = self.path + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(self.entries, f, indent=2)
+        os.replace(tmp_file, self.path)
+
+    def lookup(self, enclosure, model):
+        '''stored 'FOPDT', 'FP' or 'PID' entry of an enclosure, or None'''
+        return self.entries.get(enclosure, {}).get(model)
+
+    def _store(self, enclosure, model, values):
+        values['updated'] = time.time()
+        self.entries.setdefault(enclosure, {})[model] = values
+        self._save()
+
+    def expire(self, enclosure, model=None):
+        '''drop one model (or all entries) of an enclosure'''
+        if model is None:
+            self.entries.pop(enclosure, None)
+        else:
+            self.entries.get(enclosure, {}).pop(model, None)
+        self._save()
+
+    def _guess(self, entry, rms):
+        '''stored parameters to warm start from, or None if the entry has drifted'''
+        if entry is None:
+            return None
+        if max(rms, self.min_rms) > self.max_drift*max(entry['rms'], self.min_rms):
+            print('Cached fit has drifted (RMS error {:.3f} vs {:.3f}), refitting from scratch'
+                  .format(rms, entry['rms']))
+            return None
+        return entry['parameters']
+
+    def record_fopdt(self, enclosure, data_file, sol):
+        '''store a FOPDT fit (a dict with Kp, tauP and thetaP) made to data_file'''
+        t, u, T = opt.read_data_file(data_file)
+        parameters = [float(sol['Kp']), float(sol['tauP']), float(sol['thetaP'])]
+        SSE = opt.fopdt_err(parameters, t, u, T)
+        self._store(enclosure, 'FOPDT', {'fingerprint': fingerprint(data_file), 'parameters': parameters,
+                                         'SSE': float(SSE), 'rms': float(np.sqrt(SSE/len(t)))})
+        return self.lookup(enclosure, 'FOPDT')
+
+    def fit_fopdt(self, enclosure, data_file):
+        '''Fit the FOPDT model to data_file, reusing or warm starting from the stored fit
+
+        Returns Kp, tauP, thetaP and SSE as optimization.optimize_parameters
+        does, with 'source' set to 'cached', 'warm' or 'cold'.
+        '''
+        entry = self.lookup(enclosure, 'FOPDT')
+        if entry and entry['fingerprint'] == fingerprint(data_file):
+            Kp, tauP, thetaP = entry['parameters']
+            return {'Kp': Kp, 'tauP': tauP, 'thetaP': thetaP, 'SSE': entry['SSE'], 'source': 'cached'}
+
+        guess = None
+        if entry:
+            t, u, T = opt.read_data_file(data_file)
+            guess = self._guess(entry, np.sqrt(opt.fopdt_err(entry['parameters'], t, u, T)/len(t)))
+        sol = opt.optimize_parameters(data_file, show_plot=False, initial_guess=guess)
+        self.record_fopdt(enclosure, data_file, sol)
+        sol['source'] = 'warm' if guess is not None else 'cold'
+        return sol
+
+    def fit_first_principles(self, enclosure, data_file):
+        '''Fit the first-principles model to data_file, reusing or warm starting from the stored fit
+
+        Returns UA, alpha and SSE as fp.optimize_parameters does, with
+        'source' set to 'cached', 'warm' or 'cold'.
+        '''
+        entry = self.lookup(enclosure, 'FP')
+        key = fingerprint(data_file)
+        if entry and entry['fingerprint'] == key:
+            UA, alpha = entry['parameters']
+            return {'UA': UA, 'alpha': alpha, 'SSE': entry['SSE'], 'source': 'cached'}
+
+        data = fp.load_data(data_file)
+        guess = None
+        if entry:
+            guess = self._guess(entry, np.sqrt(fp.model_error(entry['parameters'], data)/len(data)))
+        if guess is None:
+            sol = fp.optimize_parameters(data_file=data_file)
+        else:
+            sol = fp.optimize_parameters(parameters=guess, data_file=data_file)
+        self._store(enclosure, 'FP', {'fingerprint': key, 'parameters': [float(sol['UA']), float(sol['alpha'])],
+                                      'SSE': float(sol['SSE']), 'rms': float(np.sqrt(sol['SSE']/len(data)))})
+        sol['source'] = 'warm' if guess is not None else 'cold'
+        return sol
+
+    def record_pid(self, enclosure, K_c, Tau_I, Tau_D):
+        self._store(enclosure, 'PID', {'K_c': float(K_c), 'Tau_I': float(Tau_I), 'Tau_D': float(Tau_D)})
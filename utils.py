@@ -1,22 +1,27 @@
 import matplotlib.pyplot as plt
-import pandas as pd
+from datacache import load_run
+from decimate import decimate
 
-def plot_data(data_file='data.csv', saved_image='data.png', show_plots=True):
-    data = pd.read_csv(data_file, sep=',')
+def plot_data(data_file='data.csv', saved_image='data.png', show_plots=True, figsize=(8, 6), dpi=100):
+    '''plot a run log, reduced to a few points per pixel of figure width'''
+    data = load_run(data_file)
+    fig = plt.figure(figsize=figsize, dpi=dpi)
+    buckets = int(figsize[0]*dpi)
+    series = decimate(data, ['D', 'P', 'I', 'Err', 'box temp', 'outside temp', 'SP'], buckets)
 
     plt.subplot(2, 1, 1)
-    plt.plot(data['# time'], data['D'], label='D') # Plot this first on purpose
-    plt.plot(data['# time'], data['P'], label='P')
-    plt.plot(data['# time'], data['I'], label='I')
-    plt.plot(data['# time'], data['Err'], label='Error')
+    plt.plot(*series['D'], label='D') # Plot this first on purpose
+    plt.plot(*series['P'], label='P')
+    plt.plot(*series['I'], label='I')
+    plt.plot(*series['Err'], label='Error')
     plt.legend()
 
     plt.subplot(2, 1, 2)
-    plt.plot(data['# time'], data['box temp'], label='box temp')
-    plt.plot(data['# time'], data['outside temp'], label='outside temp')
-    plt.plot(data['# time'], data['SP'], label='setpoint')
+    plt.plot(*series['box temp'], label='box temp')
+    plt.plot(*series['outside temp'], label='outside temp')
+    plt.plot(*series['SP'], label='setpoint')
     plt.legend()
-    plt.savefig(saved_image)
+    fig.savefig(saved_image, dpi=dpi)
     if show_plots:
         plt.show()
 